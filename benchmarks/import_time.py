@@ -0,0 +1,34 @@
+from os import path
+from statistics import median
+from subprocess import check_call
+from sys import executable, exit
+from time import perf_counter
+
+
+# Upper bound, in seconds, on importing the randomizer in a fresh process,
+# over and above starting the interpreter itself.
+MAX_IMPORT_TIME = 0.25
+REPEATS = 5
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def time_command(code):
+    timings = []
+    for _ in range(REPEATS):
+        start = perf_counter()
+        check_call([executable, '-c', code], cwd=ROOT)
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def measure_import_time():
+    return time_command('import randomizer') - time_command('pass')
+
+
+if __name__ == '__main__':
+    import_time = measure_import_time()
+    print('import randomizer: {0:.3f}s (limit {1:.3f}s)'.format(
+        import_time, MAX_IMPORT_TIME))
+    if import_time > MAX_IMPORT_TIME:
+        print('FAILED: import is slower than the limit.')
+        exit(1)
@@ -0,0 +1,172 @@
+from os import path
+from shutil import rmtree
+from statistics import median
+from sys import exit, path as sys_path
+from tempfile import mkdtemp
+from time import perf_counter
+import json
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from synthetic_rom import (
+    LABEL, NUM_FOLDERS, FILES_PER_FOLDER, FILE_SIZE, build_synthetic_rom)
+
+
+# Times seed generation and its hot spots against a synthetic rom, and
+# compares the medians with the ones stored in BASELINES_FILENAME. Record
+# new baselines on the machine that runs the comparison with --save.
+
+BASELINES_FILENAME = path.join(path.dirname(path.abspath(__file__)),
+                               'baselines.json')
+DEFAULT_TOLERANCE = 0.25
+REPEATS = 5
+SEED = 12345
+FLAGS = 'bdft'
+RANDOM_DEGREE = 0.5
+
+
+def time_function(function, setup=None, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def run_benchmarks(sourcefile, workdir):
+    from randomizer import (
+        PinObject, ThreadsObject, FoodObject, SwagObject,
+        ShopItemObject, generate_from_file, setup_job,
+        restore_vanilla_tables)
+    from contextlib import redirect_stdout
+    from os import devnull
+    from file_extractor import extract
+
+    results = {}
+
+    def generate():
+        generate_from_file(sourcefile, SEED, FLAGS,
+                           random_degree=RANDOM_DEGREE)
+
+    # The first run reads the rom; later ones restore the vanilla snapshot.
+    start = perf_counter()
+    generate()
+    results['generate (first seed)'] = perf_counter() - start
+    results['generate'] = time_function(generate)
+
+    def reset():
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            restore_vanilla_tables()
+            setup_job(sourcefile, SEED, FLAGS, RANDOM_DEGREE)
+
+    items = ThreadsObject.every + FoodObject.every + SwagObject.every
+    results['ItemObject.rank'] = time_function(
+        lambda: [o.rank for o in items], reset)
+    results['PinObject.drop_rank'] = time_function(
+        lambda: [p.drop_rank for p in PinObject.every], reset)
+    results['PinObject.rank'] = time_function(
+        lambda: [p.rank for p in PinObject.every], reset)
+    results['ShopItemObject.randomize_all'] = time_function(
+        ShopItemObject.randomize_all, reset)
+
+    def randomize():
+        reset()
+        ShopItemObject.randomize_all()
+
+    results['ShopItemObject.full_preclean'] = time_function(
+        ShopItemObject.full_preclean, randomize)
+
+    def preclean():
+        randomize()
+        ShopItemObject.full_preclean()
+
+    results['ShopItemObject.full_cleanup'] = time_function(
+        ShopItemObject.full_cleanup, preclean)
+
+    outdir = path.join(workdir, 'dump')
+    extract_time = time_function(
+        lambda: extract(sourcefile, outdir, verbose=False),
+        lambda: rmtree(outdir, ignore_errors=True))
+    results['extract'] = extract_time
+    results['extract MiB/s'] = (NUM_FOLDERS * FILES_PER_FOLDER * FILE_SIZE
+                                / float(1 << 20) / extract_time)
+    return results
+
+
+def compare(results, baselines):
+    # Returns the benchmarks that got slower and those with no baseline.
+    failures, missing = [], []
+    print('{0:<32} {1:>10} {2:>10} {3:>8}'.format(
+        'benchmark', 'result', 'baseline', 'change'))
+    for (name, value) in results.items():
+        if name not in baselines:
+            print('{0:<32} {1:>10.4f} {2:>10} {3:>8}'.format(
+                name, value, '-', '-'))
+            missing.append(name)
+            continue
+        baseline = baselines[name]['value']
+        tolerance = baselines[name].get('tolerance', DEFAULT_TOLERANCE)
+        change = (value - baseline) / baseline
+        # Throughputs get better as they go up, timings as they go down.
+        if name.endswith('/s'):
+            change = -change
+        print('{0:<32} {1:>10.4f} {2:>10.4f} {3:>+7.1%}'.format(
+            name, value, baseline, change))
+        if change > tolerance:
+            failures.append(name)
+    return failures, missing
+
+
+def save_baselines(results, baselines):
+    for (name, value) in results.items():
+        tolerance = baselines.get(name, {}).get('tolerance',
+                                                DEFAULT_TOLERANCE)
+        baselines[name] = {'value': value, 'tolerance': tolerance}
+    with open(BASELINES_FILENAME, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Benchmark against a synthetic rom.')
+    parser.add_argument('--save', action='store_true',
+                        help='store these results as the new baselines')
+    args = parser.parse_args()
+
+    workdir = mkdtemp(prefix='fractalizon-bench-')
+    try:
+        # Keep the synthetic tables out of the real table cache.
+        import tablecache
+        tablecache.CACHE_DIRECTORY = path.join(workdir, 'cache')
+        from randomtools.tablereader import set_global_label
+        set_global_label(LABEL)
+
+        sourcefile = build_synthetic_rom(path.join(workdir, 'synthetic.nds'))
+        results = run_benchmarks(sourcefile, workdir)
+    finally:
+        rmtree(workdir)
+
+    baselines = {}
+    if path.exists(BASELINES_FILENAME):
+        with open(BASELINES_FILENAME) as f:
+            baselines = json.load(f)
+
+    failures, missing = compare(results, baselines)
+    if args.save:
+        save_baselines(results, baselines)
+        print('Baselines saved to %s' % BASELINES_FILENAME)
+        exit(0)
+
+    # Baselines depend on the machine, so none are committed; a missing
+    # one fails rather than letting a regression pass unnoticed.
+    if missing:
+        print('FAILED: no baseline for: %s' % ', '.join(missing))
+        print('Record baselines on this machine with --save.')
+    if failures:
+        print('FAILED: slower than the baseline: %s' % ', '.join(failures))
+    if missing or failures:
+        exit(1)
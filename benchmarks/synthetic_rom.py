@@ -0,0 +1,193 @@
+from os import path
+from random import Random
+from sys import path as sys_path
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from romfile import FILENAME_ADDR, FILEPTR_ADDR
+from tablelayout import (
+    get_layout, get_record_size, get_table_specs, encode_record)
+
+
+# Builds a stand-in rom with every table from tables_list.txt at its real
+# offset and with its real record count, filled with random but plausible
+# values, plus a small filesystem for file_extractor.py. Nothing in it
+# comes from the game.
+
+LABEL = 'TWEWY_NA'
+NUM_OVERLAYS = 48
+NUM_FOLDERS = 8
+FILES_PER_FOLDER = 16
+FILE_SIZE = 0x10000
+
+NUM_PINS, NUM_THREADS, NUM_FOOD, NUM_SWAG = 304, 280, 42, 150
+NUM_BRANDS = 13
+NUM_EQUIP_TYPES = 6
+YEN_PINS = range(245, 261)
+QUEST_INDEX_BASE = 0x320
+SHOPS = [0x01, 0x02, 0x03, 0x04, 0x06, 0x07, 0x08, 0x0a, 0x0c, 0x13, 0x14,
+         0x15, 0x16, 0x1a, 0x1b, 0x1c, 0x1f, 0x20, 0x21, 0x23, 0x26, 0x27,
+         0x29, 0x2b, 0x2c, 0x2d]
+
+
+def pin_record(r, i):
+    evolves = [0, 0]
+    if r.random() < 0.2:
+        evolves[0] = r.randint(1, NUM_PINS-1)
+    return {'pin_index': i,
+            'brand': 0xFF if i in YEN_PINS else r.randrange(NUM_BRANDS),
+            'pin_class': r.randint(0, 6),
+            'price': 0 if r.random() < 0.1 else r.randint(1, 300) * 10,
+            'evolves': evolves}
+
+
+def threads_record(r, i):
+    # Cycle brands and equip types so that every brand comes in every
+    # equip type, as the shop requirements expect.
+    return {'threads_index': i,
+            'brand': i % NUM_BRANDS,
+            'equip_type': (i // NUM_BRANDS) % NUM_EQUIP_TYPES,
+            'price': r.randint(1, 500) * 100,
+            'bravery': r.randint(0, 60),
+            'defense': r.choice([0, r.randint(1, 30)]),
+            'attack': r.choice([0, r.randint(1, 30)]),
+            'hp': r.choice([0, r.randint(1, 30)]),
+            'ability': r.randint(0, 50)}
+
+
+def food_record(r, i):
+    return {'food_index': i,
+            'bites': r.randint(1, 6),
+            'price': r.randint(1, 100) * 10,
+            'status': r.randint(0, 5),
+            'boost': r.randint(1, 10),
+            'sync': r.randint(1, 20) * 5,
+            'neku': r.randint(0, 5), 'shiki': r.randint(0, 5),
+            'joshua': r.randint(0, 5), 'beat': r.randint(0, 5)}
+
+
+def swag_record(r, i):
+    return {'price': r.randint(1, 100) * 100}
+
+
+def enemy_record(r, i):
+    return {'pp': r.randint(1, 50),
+            'exp': r.randint(1, 2000),
+            'hp': r.randint(10, 5000),
+            'attack': r.randint(1, 500),
+            'drops': [r.randrange(NUM_PINS) for _ in range(4)],
+            'drop_rates': [r.randint(1, 10000) for _ in range(4)]}
+
+
+def get_item_type_code(item_index):
+    for (code, limit) in enumerate([NUM_PINS, NUM_THREADS, NUM_FOOD,
+                                    NUM_SWAG]):
+        if item_index < limit:
+            return code
+        item_index -= limit
+    return 4
+
+
+def quest_record(r, i):
+    num_items = NUM_PINS + NUM_THREADS + NUM_FOOD + NUM_SWAG
+    return {'quest_index': QUEST_INDEX_BASE + i,
+            'item_index': r.randrange(num_items),
+            'materials': [r.randrange(num_items) for _ in range(3)],
+            'amounts': [r.randint(0, 3) for _ in range(3)]}
+
+
+def shop_item_record(r, i):
+    num_items = NUM_PINS + NUM_THREADS + NUM_FOOD + NUM_SWAG
+    if r.random() < 0.05:
+        item_index = QUEST_INDEX_BASE + r.randrange(180)
+    else:
+        item_index = r.randrange(num_items)
+    return {'shop_index': SHOPS[i % len(SHOPS)],
+            'item_index': item_index,
+            'item_type_code': get_item_type_code(item_index),
+            'day_available': r.randint(1, 21)}
+
+
+RECORD_GENERATORS = {
+    'PinObject': pin_record,
+    'ThreadsObject': threads_record,
+    'FoodObject': food_record,
+    'SwagObject': swag_record,
+    'EnemyObject': enemy_record,
+    'QuestObject': quest_record,
+    'ShopItemObject': shop_item_record,
+    }
+
+
+def build_tables(r, label=LABEL):
+    # Returns [(pointer, data), ...]
+    tables = []
+    for (objname, spec) in sorted(get_table_specs(label).items()):
+        layout = get_layout(spec.tablefile)
+        if not get_record_size(layout):
+            continue
+        generator = RECORD_GENERATORS.get(objname, lambda r, i: {})
+        defaults = {f.name: [0] * f.number if f.is_list else 0
+                    for f in layout}
+        data = b''.join(encode_record(layout, dict(defaults,
+                                                   **generator(r, i)))
+                        for i in range(spec.count))
+        tables.append((spec.pointer, data))
+    return tables
+
+
+def build_filesystem(r, start):
+    # Returns the FNT, the FAT and [(address, data), ...] for the files.
+    fnt = bytearray()
+    files = []
+    address = start
+    for i in range(NUM_FOLDERS):
+        for j in range(FILES_PER_FOLDER):
+            filename = 'file_{0:0>2}.bin'.format(j).encode('ascii')
+            fnt.append(len(filename))
+            fnt.extend(filename)
+            files.append((address, r.getrandbits(8 * FILE_SIZE).to_bytes(
+                FILE_SIZE, byteorder='little')))
+            address += FILE_SIZE
+        fnt.append(0x00)
+    fnt.append(0xFF)
+    assert FILENAME_ADDR + len(fnt) <= FILEPTR_ADDR
+
+    fat = bytearray()
+    for _ in range(NUM_OVERLAYS):
+        fat.extend(bytes(8))
+    for (address, data) in files:
+        fat.extend(address.to_bytes(4, byteorder='little'))
+        fat.extend((address + len(data)).to_bytes(4, byteorder='little'))
+    fat.extend(b'\xff' * 8)
+    return bytes(fnt), bytes(fat), files
+
+
+def build_synthetic_rom(filename, seed=0, label=LABEL):
+    r = Random(seed)
+    regions = build_tables(r, label)
+    end = max(pointer + len(data) for (pointer, data) in regions)
+    end = (end + 0xFFFF) & ~0xFFFF
+    fnt, fat, files = build_filesystem(r, end)
+    assert FILEPTR_ADDR + len(fat) <= min(p for (p, _) in regions
+                                          if p > FILEPTR_ADDR)
+    regions += [(FILENAME_ADDR, fnt), (FILEPTR_ADDR, fat)] + files
+
+    size = max(pointer + len(data) for (pointer, data) in regions)
+    with open(filename, 'wb') as f:
+        # Leave the gaps unwritten, so the file stays sparse.
+        f.truncate(size)
+        for (pointer, data) in sorted(regions):
+            f.seek(pointer)
+            f.write(data)
+    return filename
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Write a synthetic rom fixture.')
+    parser.add_argument('filename')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    build_synthetic_rom(args.filename, args.seed)
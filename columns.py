@@ -0,0 +1,91 @@
+from array import array
+from collections.abc import Mapping
+
+
+TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+class ColumnTable(object):
+    # The values of every record in a table, stored as one typed array
+    # per field. List fields are flattened, `number` values per record.
+    def __init__(self, layout, count):
+        self.layout = layout
+        self.count = count
+        self.fields = {f.name: f for f in layout}
+        self.columns = {}
+        for f in layout:
+            column = array(TYPECODES[f.size])
+            assert column.itemsize == f.size
+            column.frombytes(bytes(f.size * f.number * count))
+            self.columns[f.name] = column
+
+    def column(self, name):
+        return self.columns[name]
+
+    def get(self, index, name):
+        f = self.fields[name]
+        column = self.columns[name]
+        if f.is_list:
+            return column[index*f.number:(index+1)*f.number].tolist()
+        return column[index]
+
+    def values(self, name):
+        # Every record's value for the field, in record order.
+        f = self.fields[name]
+        values = self.columns[name].tolist()
+        if f.is_list:
+            return [values[i:i+f.number]
+                    for i in range(0, len(values), f.number)]
+        return values
+
+    def load_rows(self, rows):
+        # rows holds a flat tuple of values for every record, in layout
+        # order, as unpacked by a RecordCodec.
+        assert len(rows) == self.count
+        flat_columns = list(zip(*rows))
+        offset = 0
+        for f in self.layout:
+            if f.is_list:
+                values = [v for record in zip(
+                    *flat_columns[offset:offset+f.number]) for v in record]
+            else:
+                values = flat_columns[offset]
+            self.columns[f.name] = array(self.columns[f.name].typecode,
+                                         values)
+            offset += f.number
+
+    def record(self, index):
+        return ColumnRecord(self, index)
+
+    def copy(self):
+        other = ColumnTable.__new__(ColumnTable)
+        other.layout = self.layout
+        other.count = self.count
+        other.fields = self.fields
+        other.columns = {name: array(column.typecode, column)
+                         for (name, column) in self.columns.items()}
+        return other
+
+
+class ColumnRecord(Mapping):
+    # A read-only, dict-like view of one record in a ColumnTable, used in
+    # place of a per-object old_data dict.
+    __slots__ = ['table', 'index']
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, name):
+        if name not in self.table.fields:
+            raise KeyError(name)
+        return self.table.get(self.index, name)
+
+    def __iter__(self):
+        return iter(self.table.fields)
+
+    def __len__(self):
+        return len(self.table.fields)
+
+    def __repr__(self):
+        return repr(dict(self))
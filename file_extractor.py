@@ -1,90 +1,88 @@
-from randomtools.utils import read_multi
-from sys import argv
-from subprocess import call
+from romfile import RomFile, copy_extent
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from os import path, makedirs, cpu_count
 
-FILENAME_ADDR = 0x3ac090
-FILEPTR_ADDR = 0x3afe00
 
-f = open(argv[1])
-f.seek(FILENAME_ADDR)
+# The first FAT entries belong to the overlays, which have no names in
+# the filename table.
+NUM_OVERLAYS = 48
 
-filenames = []
-sub_filenames = []
-seen_null = False
-while True:
-    is_folder = False
-    length = ord(f.read(1))
-    if length == 0x00:
-        filenames.append(sub_filenames)
-        sub_filenames = []
-        seen_null = True
-        continue
-    if length == 0xFF:
-        break
-    if length & 0x80:
-        is_folder = True
-        seen_null = False
-        length = (length & 0x7F)+1
-    else:
-        assert seen_null or True
-    filename = f.read(length)
-    if is_folder:
-        filename = '+' + filename
-        filenames.append(filename)
-    else:
-        sub_filenames.append(filename)
-    if is_folder:
-        peek = ord(f.read(1))
-        assert peek == 0xF0
 
-filenames.append(sub_filenames)
+def read_folders(rom):
+    # Returns [(foldername, [(filename, start, end), ...]), ...]
+    filenames = [fs for fs in rom.read_fnt() if fs and not isinstance(fs, str)]
+    addresses = rom.read_fat()[NUM_OVERLAYS:]
+    assert len(addresses) == sum(len(fs) for fs in filenames)
 
-f.seek(FILEPTR_ADDR)
+    addresses = iter(addresses)
+    folders = []
+    for (i, fs) in enumerate(filenames):
+        foldername = 'FOLDER_{0:0>2X}'.format(i)
+        files = []
+        for fn in fs:
+            start, finish = next(addresses)
+            files.append((fn, start, finish))
+        folders.append((foldername, files))
+    return folders
 
-addresses = []
-while True:
-    start_addr = read_multi(f, length=4)
-    end_addr = read_multi(f, length=4)
-    if 0xFFFFFFFF in [start_addr, end_addr]:
-        break
-    addresses.append((start_addr, end_addr))
 
-f.close()
+def select_files(folders, foldernames=None, patterns=None):
+    selected = []
+    for (foldername, files) in folders:
+        if foldernames and foldername not in foldernames:
+            continue
+        if patterns:
+            files = [(fn, start, finish) for (fn, start, finish) in files
+                     if any(fnmatch(fn, p)
+                            or fnmatch('%s/%s' % (foldername, fn), p)
+                            for p in patterns)]
+            if not files:
+                continue
+        selected.append((foldername, files))
+    return selected
 
-old_filenames = list(filenames)
-foldernames = [fs for fs in filenames if isinstance(fs, basestring)]
-filenames = [fs for fs in filenames if fs and not isinstance(fs, basestring)]
 
-foldernames = sorted(foldernames, key=lambda f: f[-1])
-folderdict = {}
-
-addresses = addresses[48:]
-temp = [f for fs in filenames for f in fs]
-assert len(addresses) == len(temp)
+def extract_folder(rom, outdir, foldername, files):
+    folderpath = path.join(outdir, foldername)
+    makedirs(folderpath, exist_ok=True)
+    lines = ['+%s' % foldername]
+    for (fn, start, finish) in files:
+        length = finish-start
+        lines.append('{0:0>7X} {1: <6X} : {2}'.format(start, length, fn))
+        with open(path.join(folderpath, fn), 'wb', buffering=0) as f:
+            copy_extent(rom, f, start, length)
+    return lines
 
-for (i, fs) in enumerate(filenames):
-    name = 'FOLDER'
-    mystery = i
 
-    new_foldername = "{0}_{1:0>2X}".format(name, mystery)
-    new_foldername = "{0}_{1:0>2X}".format('FOLDER', mystery)
-    folderdict[new_foldername] = fs
-    call(['mkdir', '-p', 'dump/%s' % new_foldername])
-    print "+%s" % new_foldername
-    for fn in fs:
-        fnn = 'dump/%s/%s' % (new_foldername, fn)
-        f = open(fnn, 'w+')
-        f.close()
+def extract(romfile, outdir='dump', foldernames=None, patterns=None,
+            jobs=None, verbose=True):
+    with RomFile(romfile) as rom:
+        folders = select_files(read_folders(rom), foldernames, patterns)
+        with ThreadPoolExecutor(jobs or cpu_count()) as executor:
+            results = [executor.submit(extract_folder, rom, outdir,
+                                       foldername, files)
+                       for (foldername, files) in folders]
+            for result in results:
+                lines = result.result()
+                if verbose:
+                    print('\n'.join(lines))
+                    print()
+    return folders
 
-        start, finish = addresses.pop(0)
-        length = finish-start
-        print "{0:0>7X} {1: <6X} : {2}".format(start, length, fn)
 
-        g = open(argv[1])
-        g.seek(start)
-        data = g.read(length)
-        g.close()
-        f = open(fnn, 'r+b')
-        f.write(data)
-        f.close()
-    print
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Extract files from an NDS rom.')
+    parser.add_argument('romfile')
+    parser.add_argument('-o', '--outdir', default='dump')
+    parser.add_argument('-j', '--jobs', type=int)
+    parser.add_argument('--folder', action='append', dest='foldernames',
+                        help='extract only this folder, e.g. FOLDER_0A')
+    parser.add_argument('--file', action='append', dest='patterns',
+                        help='extract only files matching this pattern, '
+                             'e.g. "*.bin" or "FOLDER_0A/*"')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+    extract(args.romfile, args.outdir, args.foldernames, args.patterns,
+            args.jobs, verbose=not args.quiet)
@@ -0,0 +1,100 @@
+from shutil import copyfile
+from sys import argv, exit
+
+
+# IPS32 is IPS with 4-byte offsets, since NDS roms are larger than the
+# 16MB that plain IPS can address.
+HEADER = b'IPS32'
+FOOTER = b'EEOF'
+MAX_RECORD_SIZE = 0xFFFF
+# A record costs 6 bytes of overhead, so unchanged runs shorter than that
+# are cheaper to carry along inside the surrounding record.
+MERGE_DISTANCE = 6
+
+
+def diff(old, new, offset=0):
+    assert len(old) == len(new)
+    records = []
+    i = 0
+    while i < len(new):
+        if old[i] == new[i]:
+            i += 1
+            continue
+        start = end = i
+        while i < len(new) and i - start < MAX_RECORD_SIZE:
+            if old[i] != new[i]:
+                end = i + 1
+            elif i - end >= MERGE_DISTANCE:
+                break
+            i += 1
+        records.append((offset + start, bytes(new[start:end])))
+        i = end
+    return records
+
+
+def make_patch(records):
+    patch = bytearray(HEADER)
+    for (offset, data) in records:
+        assert 0 < len(data) <= MAX_RECORD_SIZE
+        patch += offset.to_bytes(4, byteorder='big')
+        patch += len(data).to_bytes(2, byteorder='big')
+        patch += data
+    patch += FOOTER
+    return bytes(patch)
+
+
+def read_patch(patch):
+    if patch[:len(HEADER)] != HEADER:
+        raise Exception('Not an IPS32 patch.')
+    records = []
+    i = len(HEADER)
+    while patch[i:i+len(FOOTER)] != FOOTER:
+        if i + 6 > len(patch):
+            raise Exception('Truncated IPS32 patch.')
+        offset = int.from_bytes(patch[i:i+4], byteorder='big')
+        length = int.from_bytes(patch[i+4:i+6], byteorder='big')
+        i += 6
+        if length == 0:
+            # RLE record, as in plain IPS.
+            if i + 3 > len(patch):
+                raise Exception('Truncated IPS32 patch.')
+            length = int.from_bytes(patch[i:i+2], byteorder='big')
+            data = patch[i+2:i+3] * length
+            i += 3
+        else:
+            data = patch[i:i+length]
+            i += length
+        if len(data) != length:
+            raise Exception('Truncated IPS32 patch.')
+        records.append((offset, data))
+    return records
+
+
+def apply_patch(patch, f):
+    for (offset, data) in read_patch(patch):
+        f.seek(offset)
+        f.write(data)
+
+
+def write_patch_file(records, filename):
+    with open(filename, 'wb') as f:
+        f.write(make_patch(records))
+
+
+def apply_patch_file(patchfile, romfile, outfile=None):
+    if outfile is not None:
+        copyfile(romfile, outfile)
+        romfile = outfile
+    with open(patchfile, 'rb') as f:
+        patch = f.read()
+    with open(romfile, 'r+b') as f:
+        apply_patch(patch, f)
+    return romfile
+
+
+if __name__ == '__main__':
+    if len(argv) not in (3, 4):
+        print('Usage: ips32.py <patch> <rom> [<output rom>]')
+        print('Without an output rom, the patch is applied in place.')
+        exit(1)
+    print(apply_patch_file(*argv[1:]))
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import json
+import tracemalloc
+
+
+class PhaseStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.peak_memory = 0
+
+    def to_dict(self):
+        return {'name': self.name, 'calls': self.calls,
+                'wall_time': self.wall_time,
+                'peak_memory': self.peak_memory}
+
+
+class PhaseProfiler(object):
+    # Records wall time, call counts and peak traced memory for named
+    # phases of a run. Phases may nest; a phase that is re-entered while
+    # it is already running (e.g. through super()) is only counted once.
+    def __init__(self, use_cprofile=False):
+        self.phases = OrderedDict()
+        self.stack = []
+        self.use_cprofile = use_cprofile
+        self.cprofile = None
+        self.last_peak = 0
+
+    def start(self):
+        tracemalloc.start()
+        self.last_peak = 0
+        if self.use_cprofile:
+            from cProfile import Profile
+            self.cprofile = Profile()
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.update_peaks()
+        tracemalloc.stop()
+
+    def update_peaks(self):
+        # tracemalloc only keeps a single peak, so fold it into every
+        # running phase before it is reset. Before Python 3.9 the peak
+        # cannot be reset; a peak unchanged since the last update was
+        # reached before the running phases, so use current usage instead.
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        elif peak == self.last_peak:
+            peak = current
+        else:
+            self.last_peak = peak
+        for (stats, _) in self.stack:
+            stats.peak_memory = max(stats.peak_memory, peak)
+
+    @contextmanager
+    def phase(self, name):
+        if any(stats.name == name for (stats, _) in self.stack):
+            yield
+            return
+
+        if name not in self.phases:
+            self.phases[name] = PhaseStats(name)
+        stats = self.phases[name]
+        self.update_peaks()
+        self.stack.append((stats, perf_counter()))
+        try:
+            yield
+        finally:
+            self.update_peaks()
+            _, start_time = self.stack.pop()
+            stats.calls += 1
+            stats.wall_time += perf_counter() - start_time
+
+    def wrap_classmethod(self, cls, attribute, function, phase_name):
+        @wraps(function)
+        def wrapper(cls, *args, **kwargs):
+            with self.phase('%s %s' % (phase_name, cls.__name__)):
+                return function(cls, *args, **kwargs)
+
+        setattr(cls, attribute, classmethod(wrapper))
+
+    def instrument(self, objects, phase_names):
+        # phase_names maps classmethod names to phase names. The original
+        # methods are all looked up before any are replaced, so subclasses
+        # do not end up calling their parents' wrappers.
+        to_wrap = [(o, attribute, getattr(o, attribute).__func__, phase_name)
+                   for o in objects
+                   for (attribute, phase_name) in phase_names.items()
+                   if hasattr(getattr(o, attribute, None), '__func__')]
+        for (o, attribute, function, phase_name) in to_wrap:
+            self.wrap_classmethod(o, attribute, function, phase_name)
+
+    def report(self):
+        lines = ['{0:<40} {1:>6} {2:>10} {3:>12}'.format(
+            'phase', 'calls', 'seconds', 'peak KiB')]
+        lines.append('-' * len(lines[0]))
+        for stats in self.phases.values():
+            lines.append('{0:<40} {1:>6} {2:>10.3f} {3:>12.1f}'.format(
+                stats.name, stats.calls, stats.wall_time,
+                stats.peak_memory / 1024.0))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        # A .json filename gets the phase table, anything else gets the
+        # cProfile statistics in pstats format.
+        if filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump([stats.to_dict()
+                           for stats in self.phases.values()], f, indent=2)
+        else:
+            self.cprofile.dump_stats(filename)
@@ -1,44 +1,198 @@
 from randomtools.tablereader import (
-    TableObject, get_global_label, tblpath, addresses, get_random_degree,
-    get_activated_patches, mutate_normal, shuffle_normal, gen_random_normal,
-    write_patch)
+    TableObject, get_global_label, set_global_label, tblpath, mutate_normal,
+    gen_random_normal, sort_good_order, close_file)
 from randomtools.utils import (
-    classproperty, cached_property, get_snes_palette_transformer,
-    read_multi, write_multi, utilrandom as random)
+    classproperty, cached_property, utilrandom as random)
 from randomtools.interface import (
-    get_outfile, get_seed, get_flags, get_activated_codes, activate_code,
-    run_interface, rewrite_snes_meta, clean_and_write, finish_interface)
-from randomtools.itemrouter import ItemRouter, ItemRouterException
-from collections import defaultdict
-from os import path
-from time import time, sleep, gmtime
-from collections import Counter
-from itertools import combinations
-from sys import argv, exc_info
+    get_outfile, get_flags, get_activated_codes, run_interface,
+    clean_and_write, finish_interface, get_sourcefile)
+import randomtools.interface
+from argparse import ArgumentParser
+from collections import defaultdict, Counter
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from hashlib import md5
+from heapq import heappush, heappop
+from io import StringIO
+from multiprocessing import cpu_count, get_context
+from os import path, devnull, remove, replace, symlink, getpid
+from shutil import copyfile, rmtree
+from tempfile import gettempdir, mkdtemp
+from time import time
+from sys import argv, exc_info, exit
 from traceback import print_exc
+from copy import copy
+import json
+import sys
+from columns import ColumnTable
+from romfile import get_rom, close_rom, write_spliced, write_regions
+from tablecache import load_cache, save_cache, find_cached_label
+from tablelayout import (
+    get_layout, get_table_specs, get_codec, read_master, get_file_md5,
+    get_rom_label)
+from reachability import ShopSchedule, get_earliest_days
+from profiler import PhaseProfiler
+import ips32
 
 
 VERSION = 1
 DIFFICULTY_FACTORS = [2, 1, 0.61, 0.4]
+MAX_BRAND_REROLLS = 100
 MAX_SHOP_INVENTORY = 32
 
-nameslibrary = defaultdict(dict)
-for nametype in ['pin', 'threads', 'food', 'swag', 'enemy']:
+
+def get_positions(sequence):
+    return {o: i for (i, o) in enumerate(sequence)}
+
+
+def parse_day(weekday):
+    week, day = weekday.split('-')
+    week, day = int(week), int(day)
+    return ((week-1) * 7) + day
+
+
+NAME_TYPES = ['pin', 'threads', 'food', 'swag', 'enemy']
+
+
+def read_names(nametype):
+    names = {}
     filename = '%s_names.txt' % nametype
     with open(path.join(tblpath, filename)) as f:
         for line in f:
             line = line.strip()
             index, name = line.split(' ', 1)
             index = int(index, 0x10)
-            nameslibrary[nametype][index] = name
+            names[index] = name
+    return names
+
+
+class NamesLibrary(dict):
+    def __missing__(self, nametype):
+        self[nametype] = read_names(nametype)
+        return self[nametype]
+
+
+nameslibrary = NamesLibrary()
+
+
+class MappedTableObject(TableObject):
+    batch_mutate = False
+    write_tables = True
+    keep_zero_attributes = []
+    round_attributes = {}
+
+    @classproperty
+    def layout(cls):
+        tablefile = get_table_specs(get_global_label())[cls.__name__].tablefile
+        return get_layout(tablefile)
+
+    @classproperty
+    def codec(cls):
+        return get_codec(cls.layout)
+
+    @classproperty
+    def old_columns(cls):
+        # Vanilla values live in one frozen column set per table, and each
+        # record's old_data is a read-only view into it.
+        if '_old_columns' not in cls.__dict__:
+            count = get_table_specs(get_global_label())[cls.__name__].count
+            cls._old_columns = ColumnTable(cls.layout, count)
+        return cls._old_columns
+
+    def read_data(self, filename=None, pointer=None):
+        if pointer is None:
+            pointer = self.pointer
+        if filename is None:
+            filename = self.filename
+        if pointer is None or filename is None:
+            return
+        # The output rom may only be a placeholder (see reserve_output()),
+        # so the vanilla tables come from the source rom.
+        filename = get_sourcefile() or filename
+
+        old_columns = self.old_columns
+        if '_columns_loaded' not in type(self).__dict__:
+            # Decode the whole table at once, on the first record read.
+            cls = type(self)
+            start = pointer - (self.index * self.total_size)
+            data = get_rom(filename).read(
+                start, old_columns.count * self.total_size)
+            old_columns.load_rows(
+                cls.codec.decode_table(data, old_columns.count))
+            cls._columns_loaded = True
+        for attribute in old_columns.fields:
+            setattr(self, attribute, old_columns.get(self.index, attribute))
+        self.old_data = old_columns.record(self.index)
+
+    @classmethod
+    def mutate_columns(cls):
+        # Mutates a whole table from one RNG stream, attribute by attribute,
+        # instead of reseeding for every object. This gives different
+        # results from the per-object mutation, so it is opt-in.
+        cls.class_reseed('batchmut')
+        every = cls.every
+        random_degree = cls.random_degree
+        for attribute in sorted(cls.mutate_attributes):
+            old_values = cls.old_columns.column(attribute)
+            minmax = cls.mutate_attributes[attribute]
+            if isinstance(minmax, tuple):
+                minimum, maximum = minmax
+            else:
+                minimum, maximum = min(old_values), max(old_values)
+
+            number = cls.old_columns.fields[attribute].number
+            is_list = cls.old_columns.fields[attribute].is_list
+            values = [getattr(o, attribute) for o in every]
+            if is_list:
+                values = [v for vs in values for v in vs]
+            assert len(values) == len(old_values)
+
+            values = [mutate_normal(v, minimum, maximum,
+                                    random_degree=random_degree)
+                      if minimum <= v <= maximum else v for v in values]
+            if attribute in cls.keep_zero_attributes:
+                values = [v if old else 0
+                          for (v, old) in zip(values, old_values)]
+            if attribute in cls.round_attributes:
+                step = cls.round_attributes[attribute]
+                values = [int(round(v / float(step))) * step if v != old
+                          else v for (v, old) in zip(values, old_values)]
+
+            if is_list:
+                for (i, o) in enumerate(every):
+                    setattr(o, attribute, values[i*number:(i+1)*number])
+            else:
+                for (o, v) in zip(every, values):
+                    setattr(o, attribute, v)
+
+    @classmethod
+    def mutate_all(cls):
+        if (MappedTableObject.batch_mutate
+                and hasattr(cls, 'mutate_attributes')):
+            cls.mutate_columns()
+            if cls.mutate is MappedTableObject.mutate:
+                return
+        super(MappedTableObject, cls).mutate_all()
 
+    def mutate(self):
+        if (MappedTableObject.batch_mutate
+                and hasattr(self, 'mutate_attributes')):
+            return
+        super(MappedTableObject, self).mutate()
 
-class VanillaObject(TableObject):
+    @classmethod
+    def write_all(cls, *args, **kwargs):
+        # Turned off for in-memory runs that only inspect the tables.
+        if not MappedTableObject.write_tables:
+            return
+        super(MappedTableObject, cls).write_all(*args, **kwargs)
+
+
+class VanillaObject(MappedTableObject):
     flag = 'v'
     flag_description = 'nothing'
 
 
-class EnemyObject(TableObject):
+class EnemyObject(MappedTableObject):
     flag = 'd'
     flag_description = 'enemy drops'
     custom_random_enable = 'd'
@@ -86,6 +240,25 @@ class EnemyObject(TableObject):
     def old_drops_pins(self):
         return [PinObject.get(d) for d in self.fixed_drop_indexes]
 
+    @classproperty
+    def drop_index(cls):
+        if hasattr(EnemyObject, '_drop_index'):
+            return EnemyObject._drop_index
+
+        drop_index = defaultdict(list)
+        for e in EnemyObject.every:
+            for (slot, (difficulty, drop, drop_rate)) in enumerate(zip(
+                    DIFFICULTY_FACTORS, e.fixed_drop_indexes,
+                    e.old_data['drop_rates'])):
+                drop_index[drop].append((e, slot, difficulty, drop_rate))
+
+        EnemyObject._drop_index = dict(drop_index)
+        return EnemyObject.drop_index
+
+    @classmethod
+    def get_drop_sources(cls, pin_index):
+        return EnemyObject.drop_index.get(pin_index, [])
+
     def mutate_drops(self):
         new_drops = []
         for (i, d) in enumerate(self.old_drops_pins):
@@ -113,7 +286,7 @@ class EnemyObject(TableObject):
             self.drop_rates = [10000] * 4
 
 
-class ItemObject(TableObject):
+class ItemObject(MappedTableObject):
     @property
     def name(self):
         try:
@@ -124,31 +297,17 @@ class ItemObject(TableObject):
 
     @cached_property
     def is_buyable(self):
-        for si in ShopItemObject.every:
-            if si.old_item is self:
-                return True
-        return False
+        return self in ShopItemObject.old_item_index
 
     @cached_property
     def is_quest_buyable(self):
         if self.is_buyable:
             return True
-        for si in ShopItemObject.every:
-            if (isinstance(si.old_item, QuestObject)
-                    and si.old_item.old_item is self):
-                return True
-        return False
+        return self in ShopItemObject.old_quest_item_index
 
     @cached_property
     def old_shop_availability(self):
-        days = [si.old_data['day_available'] for si in ShopItemObject.every
-                if si.old_item is self
-                or (isinstance(si.old_item, QuestObject)
-                    and si.old_item.old_item is self)]
-        days = [d for d in days if d]
-        if days:
-            return min(days)
-        return 100
+        return ShopItemObject.old_item_days.get(self, 100)
 
     @cached_property
     def intershuffle_valid(self):
@@ -163,28 +322,47 @@ class ItemObject(TableObject):
         if not self.intershuffle_valid:
             return -1
 
-        if hasattr(self, '_rank'):
-            return self._rank
+        if not hasattr(self, '_rank'):
+            self.compute_ranks()
+        return self._rank
 
+    @classmethod
+    def compute_ranks(cls):
         sorted_items = sorted(
-            self.every, key=lambda o: (o.old_data['price'], o.signature))
+            cls.every, key=lambda o: (o.old_data['price'], o.signature))
         sorted_items = [o for o in sorted_items if o.intershuffle_valid]
-        for o in sorted_items:
-            o._rank = sorted_items.index(o) / float(len(sorted_items)-1)
+        for (i, o) in enumerate(sorted_items):
+            o._rank = i / float(len(sorted_items)-1)
+
+    @classproperty
+    def every_item(cls):
+        if hasattr(ItemObject, '_every_item'):
+            return ItemObject._every_item
+
+        every_item = (PinObject.every + ThreadsObject.every +
+                      FoodObject.every + SwagObject.every)
+
+        ItemObject._every_item = every_item
+        return ItemObject.every_item
+
+    @classproperty
+    def item_indexes(cls):
+        if hasattr(ItemObject, '_item_indexes'):
+            return ItemObject._item_indexes
 
-        return self.rank
+        item_indexes = {item: index
+                        for (index, item) in enumerate(ItemObject.every_item)}
+
+        ItemObject._item_indexes = item_indexes
+        return ItemObject.item_indexes
 
     @classmethod
     def get_by_index(cls, index):
-        item = (PinObject.every + ThreadsObject.every +
-                FoodObject.every + SwagObject.every)[index]
-        return item
+        return ItemObject.every_item[index]
 
     @classmethod
     def get_index_by_item(cls, item):
-        index = (PinObject.every + ThreadsObject.every +
-                 FoodObject.every + SwagObject.every).index(item)
-        return index
+        return ItemObject.item_indexes[item]
 
     def price_cleanup(self):
         if 'phantomthief' in get_activated_codes():
@@ -229,49 +407,49 @@ class PinObject(ItemObject):
         PinObject._yen_pins = yen_pins
         return PinObject.yen_pins
 
+    @property
+    def drop_sources(self):
+        return EnemyObject.get_drop_sources(self.index)
+
     @cached_property
     def drop_rank(self):
         ranks = []
-        for e in EnemyObject.every:
+        for (e, slot, difficulty, drop_rate) in self.drop_sources:
             if not e.intershuffle_valid:
                 continue
-            for difficulty, drop, drop_rate in zip(
-                    DIFFICULTY_FACTORS, e.fixed_drop_indexes, e.drop_rates):
-                if drop == self.index:
-                    assert self.name in e.old_drop_names
-                    rank = drop_rate * e.rank / (difficulty * 10000.0)
-                    rank = e.rank / difficulty
-                    if rank > 0:
-                        ranks.append(rank)
+            rank = e.rank / difficulty
+            if rank > 0:
+                ranks.append(rank)
         if ranks:
             return sum(ranks) / float(len(ranks))
         return 0
 
-    @property
-    def rank(self):
-        if hasattr(self, '_rank'):
-            return self._rank
+    @classmethod
+    def compute_ranks(cls):
+        # Consumes the RNG exactly like the original per-pin lookups did, so
+        # it must run at the same point in the seed (i.e. on first access).
+        every = PinObject.every
 
-        by_price = sorted(self.every, key=lambda p: (p.price, p.signature))
+        by_price = sorted(every, key=lambda p: (p.price, p.signature))
         by_price = [p for p in by_price if p.price > 0 and p.is_buyable]
-        by_drop_rank = sorted(
-            self.every, key=lambda p: (p.drop_rank, p.signature))
+        by_drop_rank = sorted(every, key=lambda p: (p.drop_rank, p.signature))
         by_drop_rank = [p for p in by_drop_rank if p.drop_rank > 0]
         by_shop_day = sorted(
-            self.every, key=lambda p: (p.old_shop_availability, p.signature))
+            every, key=lambda p: (p.old_shop_availability, p.signature))
         by_shop_day = [p for p in by_shop_day if p.is_quest_buyable]
 
-        for p in self.every:
+        price_positions = get_positions(by_price)
+        drop_positions = get_positions(by_drop_rank)
+        for p in every:
             ranks = []
-            if p in by_price and p.is_buyable:
-                ranks.append(by_price.index(p) / float(len(by_price))-1)
-            if p in by_drop_rank:
-                ranks.append(
-                    by_drop_rank.index(p) / float(len(by_drop_rank))-1)
+            if p in price_positions:
+                ranks.append(price_positions[p] / float(len(by_price))-1)
+            if p in drop_positions:
+                ranks.append(drop_positions[p] / float(len(by_drop_rank))-1)
             if ranks:
                 p._rank = min(ranks)
 
-        for p in self.every:
+        for p in every:
             if hasattr(p, '_rank'):
                 for ev in p.evolves:
                     if ev:
@@ -281,47 +459,53 @@ class PinObject(ItemObject):
                             new_rank = (value * 1.0) + ((1-value) * p._rank)
                             p2._rank = new_rank
 
-        by_price = sorted(self.every, key=lambda p: (p.price, p.signature))
+        by_price = sorted(every, key=lambda p: (p.price, p.signature))
         by_price = [p for p in by_price if p.price > 0]
-        for p in self.every:
+        price_positions = get_positions(by_price)
+        shop_day_positions = get_positions(by_shop_day)
+        for p in every:
             if hasattr(p, '_rank'):
                 continue
 
-            if p in by_shop_day:
-                p._rank = by_shop_day.index(p) / float(len(by_shop_day)-1)
-            elif p in by_price:
-                p._rank = by_price.index(p) / float(len(by_price)-1)
+            if p in shop_day_positions:
+                p._rank = shop_day_positions[p] / float(len(by_shop_day)-1)
+            elif p in price_positions:
+                p._rank = price_positions[p] / float(len(by_price)-1)
             else:
                 p._rank = random.random()
 
-        sorted_class = sorted(
-            self.every, key=lambda p: (-p.pin_class, p._rank, p.signature))
-        sorted_noclass = sorted(
-            self.every, key=lambda p: (p._rank, p.signature))
-        for p in self.every:
+        class_positions = get_positions(sorted(
+            every, key=lambda p: (-p.pin_class, p._rank, p.signature)))
+        noclass_positions = get_positions(sorted(
+            every, key=lambda p: (p._rank, p.signature)))
+        for p in every:
             if p.pin_class >= 5:
-                rank = sorted_noclass.index(p)
+                rank = noclass_positions[p]
             else:
                 value = gen_random_normal()
-                rank = ((sorted_class.index(p) * value)
-                        + ((1-value) * sorted_noclass.index(p)))
+                rank = ((class_positions[p] * value)
+                        + ((1-value) * noclass_positions[p]))
             p._rank = mutate_normal(
-                rank, minimum=0, maximum=len(self.every), wide=True,
-                random_degree=self.random_degree**2, return_float=True)
+                rank, minimum=0, maximum=len(every), wide=True,
+                random_degree=cls.random_degree**2, return_float=True)
 
-        sorted_noclass = sorted(
-            self.every, key=lambda p: (p._rank, p.signature))
-        for p in self.every:
-            p._rank = sorted_noclass.index(p) / float(len(sorted_noclass)-1)
+        noclass_positions = get_positions(sorted(
+            every, key=lambda p: (p._rank, p.signature)))
+        for p in every:
+            p._rank = noclass_positions[p] / float(len(every)-1)
 
-        return self.rank
+    @property
+    def rank(self):
+        if not hasattr(self, '_rank'):
+            self.compute_ranks()
+        return self._rank
 
     def cleanup(self):
         if self in self.yen_pins or ShopItemObject.flag not in get_flags():
             self.brand = self.old_data['brand']
 
 
-class AbilityObject(TableObject):
+class AbilityObject(MappedTableObject):
     flag = 'a'
     flag_description = 'threads abilities'
     custom_random_enable = 't'
@@ -340,6 +524,7 @@ class ThreadsObject(ItemObject):
         'attack': None,
         'hp': None,
         }
+    keep_zero_attributes = sorted(mutate_attributes)
 
     @classproperty
     def randomselect_attributes(self):
@@ -373,6 +558,7 @@ class FoodObject(ItemObject):
         'boost': None,
         'sync': None,
         }
+    round_attributes = {'sync': 5}
 
     def cleanup(self):
         if 'vegan' in get_activated_codes() and self.status < 3:
@@ -395,35 +581,41 @@ class SwagObject(ItemObject):
         }
 
 
-class QuestObject(TableObject):
+class QuestObject(MappedTableObject):
     def __repr__(self):
         s = '{0:0>4X} {1:0>4X} {2} {3}'.format(
             self.quest_index, self.item_index, self.item, self.unknown)
         for m, a in zip(self.materials, self.amounts):
             if a == 0:
                 continue
-            item = (PinObject.every + ThreadsObject.every +
-                    FoodObject.every + SwagObject.every)[m]
+            item = ItemObject.get_by_index(m)
             s += '\n    {0}x {1}'.format(a, item.name)
         return s
 
+    @classproperty
+    def quest_indexes(cls):
+        if hasattr(QuestObject, '_quest_indexes'):
+            return QuestObject._quest_indexes
+
+        quest_indexes = {}
+        for q in QuestObject.every:
+            assert q.quest_index not in quest_indexes
+            quest_indexes[q.quest_index] = q
+
+        QuestObject._quest_indexes = quest_indexes
+        return QuestObject.quest_indexes
+
     @classmethod
     def get_by_quest_index(cls, quest_index):
-        candidates = [q for q in QuestObject.every
-                      if quest_index == q.quest_index]
-        assert len(candidates) == 1
-        return candidates[0]
+        return QuestObject.quest_indexes[quest_index]
 
     @cached_property
     def old_item(self):
-        item_index = self.old_data['item_index']
-        return (PinObject.every + ThreadsObject.every +
-                FoodObject.every + SwagObject.every)[item_index]
+        return ItemObject.get_by_index(self.old_data['item_index'])
 
     @property
     def item(self):
-        return (PinObject.every + ThreadsObject.every +
-                FoodObject.every + SwagObject.every)[self.item_index]
+        return ItemObject.get_by_index(self.item_index)
 
     @property
     def brand(self):
@@ -443,16 +635,20 @@ class QuestObject(TableObject):
         return self.item.name
 
 
-class ShopCastObject(TableObject): pass
+class ShopCastObject(MappedTableObject): pass
 
 
-class ShopItemObject(TableObject):
+class ShopItemObject(MappedTableObject):
     flag = 'b'
     flag_description = 'shop stocks and brands'
     custom_random_enable = 'b'
 
     randomselect_attributes = ['day_available']
 
+    legacy_shop_assign = False
+    brand_rerolls = 0
+    _live_indexes = {}
+
     @classproperty
     def after_order(cls):
         return [PinObject, ThreadsObject]
@@ -471,8 +667,7 @@ class ShopItemObject(TableObject):
         if item_index >= 0x320:
             return QuestObject.get_by_quest_index(item_index)
 
-        return (PinObject.every + ThreadsObject.every +
-                FoodObject.every + SwagObject.every)[item_index]
+        return ItemObject.get_by_index(item_index)
 
     @property
     def item(self):
@@ -483,8 +678,7 @@ class ShopItemObject(TableObject):
         if self.item_index >= 0x320:
             item = QuestObject.get_by_quest_index(self.item_index)
         else:
-            item = (PinObject.every + ThreadsObject.every +
-                    FoodObject.every + SwagObject.every)[self.item_index]
+            item = ItemObject.get_by_index(self.item_index)
 
         self._previous_item_index = self.item_index
         self._previous_item = item
@@ -513,12 +707,94 @@ class ShopItemObject(TableObject):
     def rank(self):
         return self.old_item.rank
 
+    def __setattr__(self, attribute, value):
+        live_index = ShopItemObject._live_indexes.get(attribute)
+        if live_index is not None:
+            live_index[getattr(self, attribute)].discard(self)
+            live_index[value].add(self)
+        super(ShopItemObject, self).__setattr__(attribute, value)
+
+    @classmethod
+    def get_live_index(cls, attribute):
+        if attribute not in ShopItemObject._live_indexes:
+            live_index = defaultdict(set)
+            for si in ShopItemObject.every:
+                live_index[getattr(si, attribute)].add(si)
+            ShopItemObject._live_indexes[attribute] = live_index
+        return ShopItemObject._live_indexes[attribute]
+
+    @classproperty
+    def old_shop_index(cls):
+        if hasattr(ShopItemObject, '_old_shop_index'):
+            return ShopItemObject._old_shop_index
+
+        old_shop_index = defaultdict(list)
+        for si in ShopItemObject.every:
+            old_shop_index[si.old_data['shop_index']].append(si)
+
+        ShopItemObject._old_shop_index = dict(old_shop_index)
+        return ShopItemObject.old_shop_index
+
+    @classproperty
+    def old_item_index(cls):
+        if hasattr(ShopItemObject, '_old_item_index'):
+            return ShopItemObject._old_item_index
+
+        old_item_index = defaultdict(list)
+        for si in ShopItemObject.every:
+            if not isinstance(si.old_item, QuestObject):
+                old_item_index[si.old_item].append(si)
+
+        ShopItemObject._old_item_index = dict(old_item_index)
+        return ShopItemObject.old_item_index
+
+    @classproperty
+    def old_quest_item_index(cls):
+        if hasattr(ShopItemObject, '_old_quest_item_index'):
+            return ShopItemObject._old_quest_item_index
+
+        old_quest_item_index = defaultdict(list)
+        for si in ShopItemObject.every:
+            if isinstance(si.old_item, QuestObject):
+                old_quest_item_index[si.old_item.old_item].append(si)
+
+        ShopItemObject._old_quest_item_index = dict(old_quest_item_index)
+        return ShopItemObject.old_quest_item_index
+
+    @classproperty
+    def old_item_days(cls):
+        if hasattr(ShopItemObject, '_old_item_days'):
+            return ShopItemObject._old_item_days
+
+        old_item_days = {}
+        for si in ShopItemObject.every:
+            day = si.old_data['day_available']
+            if not day:
+                continue
+            item = si.old_item
+            if isinstance(item, QuestObject):
+                item = item.old_item
+            if item not in old_item_days or day < old_item_days[item]:
+                old_item_days[item] = day
+
+        ShopItemObject._old_item_days = old_item_days
+        return ShopItemObject.old_item_days
+
     @classmethod
     def get_items_by_shop_index(cls, index, old=False):
         if old:
-            return [si for si in ShopItemObject.every
-                    if si.old_data['shop_index'] == index]
-        return [si for si in ShopItemObject.every if si.shop_index == index]
+            return ShopItemObject.old_shop_index.get(index, [])
+        return sorted(ShopItemObject.get_live_index('shop_index')[index],
+                      key=lambda si: si.index)
+
+    @classmethod
+    def get_items_by_item_index(cls, index):
+        return sorted(ShopItemObject.get_live_index('item_index')[index],
+                      key=lambda si: si.index)
+
+    @classmethod
+    def get_shop_size(cls, index):
+        return len(ShopItemObject.get_live_index('shop_index')[index])
 
     @classmethod
     def get_shop_brands(cls, index):
@@ -553,8 +829,7 @@ class ShopItemObject(TableObject):
         if hasattr(ShopItemObject, '_shop_indexes'):
             return ShopItemObject._shop_indexes
 
-        indexes = set([si.old_data['shop_index']
-                       for si in ShopItemObject.every])
+        indexes = set(ShopItemObject.old_shop_index)
         ShopItemObject._shop_indexes = indexes
         return ShopItemObject.shop_indexes
 
@@ -575,12 +850,75 @@ class ShopItemObject(TableObject):
         ShopItemObject._restaurants = restaurants
         return ShopItemObject.restaurants
 
+    @classproperty
+    def day_shops(cls):
+        if hasattr(ShopItemObject, '_day_shops'):
+            return ShopItemObject._day_shops
+
+        SHOPS_FILENAME = path.join(tblpath, 'accessible_shops.txt')
+        area_shops = {}
+        for line in open(SHOPS_FILENAME):
+            line = line.strip()
+            if not (line and line[0] != '#'):
+                continue
+            area, shops = line.split(':')
+            shops = {int(s, 0x10) for s in shops.split(',')}
+            area_shops[area] = shops
+
+        AREAS_FILENAME = path.join(tblpath, 'accessible_areas.txt')
+        day_shops = defaultdict(set)
+        for line in open(AREAS_FILENAME):
+            line = line.strip()
+            if not (line and line[0] != '#'):
+                continue
+            weekday, areas = line.split(':')
+            day = parse_day(weekday)
+            areas = areas.split(',')
+            for area in areas:
+                day_shops[day] |= area_shops[area]
+
+        ShopItemObject._day_shops = dict(day_shops)
+        return ShopItemObject.day_shops
+
+    @classproperty
+    def schedule(cls):
+        if hasattr(ShopItemObject, '_schedule'):
+            return ShopItemObject._schedule
+
+        ShopItemObject._schedule = ShopSchedule(ShopItemObject.day_shops)
+        return ShopItemObject.schedule
+
+    @classmethod
+    def get_earliest_days(cls):
+        # The first day each item index can be bought in the current shops.
+        return get_earliest_days(
+            ShopItemObject.schedule,
+            [(sio.shop_index, sio.item_index, sio.day_available)
+             for sio in ShopItemObject.every])
+
+    @classproperty
+    def requirements(cls):
+        if hasattr(ShopItemObject, '_requirements'):
+            return ShopItemObject._requirements
+
+        REQS_FILENAME = path.join(tblpath, 'requirements.txt')
+        requirements = []
+        for line in open(REQS_FILENAME):
+            line = line.strip()
+            if not (line and line[0] != '#'):
+                continue
+            weekday, reqs = line.split(':')
+            requirements.append((parse_day(weekday), reqs.split(',')))
+
+        ShopItemObject._requirements = requirements
+        return ShopItemObject.requirements
+
     @classmethod
-    def randomize_brands(cls):
+    def randomize_brands(cls, salt='brand'):
         for o in ThreadsObject.every + PinObject.every:
             if o in PinObject.yen_pins:
                 continue
-            o.reseed('brand')
+            o.reseed(salt)
             o.brand = o.get_similar(
                 random_degree=ShopItemObject.random_degree).old_data['brand']
 
@@ -601,11 +939,90 @@ class ShopItemObject(TableObject):
 
         ShopItemObject.class_reseed('brands')
         ShopItemObject.randomize_brands()
+        while not ShopItemObject.brands_feasible():
+            # Reroll just the brands, rather than letting full_preclean
+            # fail the whole seed later on.
+            if ShopItemObject.brand_rerolls >= MAX_BRAND_REROLLS:
+                break
+            ShopItemObject.brand_rerolls += 1
+            ShopItemObject.randomize_brands(
+                'brand%s' % ShopItemObject.brand_rerolls)
 
         ShopItemObject.class_reseed('shops')
         to_assign = list(ShopItemObject.every)
         random.shuffle(to_assign)
 
+        if ShopItemObject.legacy_shop_assign:
+            ShopItemObject.assign_shops_legacy(to_assign)
+        else:
+            ShopItemObject.assign_shops(to_assign)
+
+    @classmethod
+    def brands_feasible(cls):
+        # full_preclean needs threads of each required brand in four
+        # different equip types, not counting equip type 3.
+        equip_types = defaultdict(set)
+        for t in ThreadsObject.every:
+            if t.equip_type != 3:
+                equip_types[t.brand].add(t.equip_type)
+        for (day, reqs) in ShopItemObject.requirements:
+            for req in reqs:
+                if (req.startswith('$')
+                        and len(equip_types[int(req[1:], 0x10)]) < 4):
+                    return False
+        return True
+
+    @classmethod
+    def assign_shops(cls, to_assign):
+        # Candidates are old shop indexes listed in ShopItemObject.every
+        # order, one entry per vanilla shop slot, so random.choice() sees
+        # the same sequence lengths as assign_shops_legacy.
+        all_shops = [c.old_data['shop_index'] for c in ShopItemObject.every]
+        brand_shops = defaultdict(list)
+        unbranded_shops = defaultdict(list)
+        for c in ShopItemObject.every:
+            old_brand = c.get_brand(old=True)
+            if old_brand is not None:
+                brand_shops[old_brand].append(c.old_data['shop_index'])
+            if c.get_brand() is None:
+                unbranded_shops[type(c.old_item)].append(
+                    c.old_data['shop_index'])
+
+        shop_sizes = Counter()
+        shop_items = defaultdict(set)
+        size_buckets = defaultdict(set)
+        size_buckets[0] = set(all_shops)
+        max_shop_size = 0
+        for sio in to_assign:
+            sio.reseed('shop')
+            item = sio.item
+
+            brand = sio.get_brand()
+            if brand is None:
+                candidates = unbranded_shops[type(item)]
+            else:
+                candidates = brand_shops[brand]
+            candidates = candidates if candidates else all_shops
+
+            temp = [s for s in candidates if item not in shop_items[s]]
+            candidates = temp if temp else candidates
+
+            if max_shop_size > 0:
+                max_shops = size_buckets[max_shop_size]
+                temp = [s for s in candidates if s not in max_shops]
+                candidates = temp if temp else candidates
+
+            chosen = random.choice(candidates)
+            sio.shop_index = chosen
+            shop_items[chosen].add(item)
+            size_buckets[shop_sizes[chosen]].remove(chosen)
+            shop_sizes[chosen] += 1
+            size_buckets[shop_sizes[chosen]].add(chosen)
+            max_shop_size = max(max_shop_size, shop_sizes[chosen])
+            assert shop_sizes[chosen] <= MAX_SHOP_INVENTORY
+
+    @classmethod
+    def assign_shops_legacy(cls, to_assign):
         shops = defaultdict(list)
         for sio in to_assign:
             sio.reseed('shop')
@@ -647,65 +1064,69 @@ class ShopItemObject(TableObject):
 
     @classmethod
     def full_preclean(cls):
-        SHOPS_FILENAME = path.join(tblpath, 'accessible_shops.txt')
-        area_shops = {}
-        for line in open(SHOPS_FILENAME):
-            line = line.strip()
-            if not (line and line[0] != '#'):
-                continue
-            area, shops = line.split(':')
-            shops = {int(s, 0x10) for s in shops.split(',')}
-            area_shops[area] = shops
-
-        AREAS_FILENAME = path.join(tblpath, 'accessible_areas.txt')
-        day_shops = defaultdict(set)
-        for line in open(AREAS_FILENAME):
-            line = line.strip()
-            if not (line and line[0] != '#'):
+        schedule = ShopItemObject.schedule
+        items_by_index = ShopItemObject.get_live_index('item_index')
+
+        # Unprotected shop items whose slot can be given up, by signature:
+        # those with the same item as a protected shop item, or as an
+        # unprotected one with a lower signature. Protecting a shop item
+        # only ever adds to these, so stale entries are skipped when popped.
+        reclaimable = []
+
+        def push_reclaimable(index):
+            shop_items = sorted(items_by_index[index],
+                                key=lambda sio: sio.signature)
+            unprotected = [sio for sio in shop_items
+                           if not hasattr(sio, '_is_protected')]
+            if len(unprotected) == len(shop_items):
+                unprotected = unprotected[1:]
+            for sio in unprotected:
+                heappush(reclaimable, (sio.signature, sio.index, sio))
+
+        for index in list(items_by_index):
+            push_reclaimable(index)
+
+        # The lowest bravery threads of each brand, at most one per equip
+        # type, in ascending order. Equip type 3 (top & bottom) is ignored.
+        lowest_threads = defaultdict(list)
+        seen_equip_types = set([])
+        for t in sorted(ThreadsObject.every,
+                        key=lambda tt: (tt.bravery, tt.signature)):
+            if (t.equip_type == 3
+                    or (t.brand, t.equip_type) in seen_equip_types):
                 continue
-            weekday, areas = line.split(':')
-            week, day = weekday.split('-')
-            week, day = int(week), int(day)
-            day = ((week-1) * 7) + day
-            areas = areas.split(',')
-            for area in areas:
-                day_shops[day] |= area_shops[area]
+            seen_equip_types.add((t.brand, t.equip_type))
+            lowest_threads[t.brand].append(t)
 
         def ensure_item_access(index, day):
             item = ItemObject.get_by_index(index)
-            ensure_shops = sorted(day_shops[day])
+            ensure_shops = schedule.shops_on(day)
 
-            existing_this = [sio for sio in ShopItemObject.every
-                             if sio.item is item
-                             and not hasattr(sio, '_is_protected')]
+            existing_this = [
+                sio for sio in ShopItemObject.get_items_by_item_index(index)
+                if not hasattr(sio, '_is_protected')]
             if existing_this:
                 chosen = random.choice(existing_this)
             else:
-                shuffled_shop_items = sorted(
-                    ShopItemObject.every,
-                    key=lambda sio: (not hasattr(sio, '_is_protected'),
-                                     sio.signature))
-                seen_items = set([])
                 chosen = None
-                for sio in shuffled_shop_items:
-                    if (sio.item in seen_items
-                            and not hasattr(sio, '_is_protected')):
+                while reclaimable:
+                    _, _, sio = heappop(reclaimable)
+                    if not hasattr(sio, '_is_protected'):
                         chosen = sio
                         break
-                    seen_items.add(sio.item)
                 chosen.shop_index = None
 
             chosen.day_available = min(day, chosen.day_available)
             chosen.item_index = index
             assert not hasattr(chosen, '_is_protected')
             chosen._is_protected = True
-            if chosen.shop_index in ensure_shops:
+            push_reclaimable(index)
+            if schedule.is_open(chosen.shop_index, day):
                 return True
 
-            ensure_shops = sorted(ensure_shops)
+            ensure_shops = list(ensure_shops)
             temp = [s for s in ensure_shops
-                    if len(ShopItemObject.get_items_by_shop_index(s))
-                    < MAX_SHOP_INVENTORY]
+                    if ShopItemObject.get_shop_size(s) < MAX_SHOP_INVENTORY]
             if temp:
                 ensure_shops = temp
 
@@ -717,32 +1138,13 @@ class ShopItemObject(TableObject):
 
             chosen.shop_index = random.choice(ensure_shops)
 
-        REQS_FILENAME = path.join(tblpath, 'requirements.txt')
-        for line in open(REQS_FILENAME):
-            line = line.strip()
-            if not (line and line[0] != '#'):
-                continue
-            weekday, reqs = line.split(':')
-            week, day = weekday.split('-')
-            week, day = int(week), int(day)
-            day = ((week-1) * 7) + day
-            reqs = reqs.split(',')
+        for (day, reqs) in ShopItemObject.requirements:
             for req in reqs:
                 if req.startswith('$'):
                     brand = int(req[1:], 0x10)
-                    used_equip_types = {3}  # ignore top & bottom from start
-                    four_lowest = set([])
-                    while len(four_lowest) < 4:
-                        candidates = sorted(
-                            [t for t in ThreadsObject.every
-                             if t.equip_type not in used_equip_types
-                             and t.brand == brand],
-                            key=lambda tt: (tt.bravery, tt.signature))
-                        if not candidates:
-                            raise Exception("Impossible seed.")
-                        chosen = candidates[0]
-                        four_lowest.add(chosen)
-                        used_equip_types.add(chosen.equip_type)
+                    four_lowest = lowest_threads[brand][:4]
+                    if len(four_lowest) < 4:
+                        raise Exception("Impossible seed.")
                     for t in sorted(four_lowest):
                         index = ItemObject.get_index_by_item(t)
                         ensure_item_access(index, day)
@@ -755,23 +1157,26 @@ class ShopItemObject(TableObject):
 
     @classmethod
     def full_cleanup(cls):
-        for sio in ShopItemObject.every:
-            similars = [s for s in ShopItemObject.every if s.item == sio.item]
-            assert sio in similars
-            day_available = min([s.day_available for s in similars])
-            for s in similars:
-                s.day_available = day_available
-
-        sorted_shop_items = sorted(
-            ShopItemObject.every,
-            key=lambda o: (
-                o.shop_index, hasattr(o.item, 'price'),
-                not isinstance(o.item, QuestObject),
-                -o.item.price if hasattr(o.item, 'price') else None,
-                o.item_index))
+        every = ShopItemObject.every
+        earliest_days = {}
+        for sio in every:
+            day_available = earliest_days.get(sio.item_index)
+            if day_available is None or sio.day_available < day_available:
+                earliest_days[sio.item_index] = sio.day_available
+        for sio in every:
+            sio.day_available = earliest_days[sio.item_index]
+
+        sort_keys = []
+        for o in every:
+            item = o.item
+            has_price = hasattr(item, 'price')
+            sort_keys.append((
+                o.shop_index, has_price, not isinstance(item, QuestObject),
+                -item.price if has_price else None, o.item_index))
         sorted_shop_items = [
             (o.shop_index, o.item_index, o.item_type_code, o.day_available)
-            for o in sorted_shop_items]
+            for o in (every[i] for i in sorted(range(len(every)),
+                                               key=sort_keys.__getitem__))]
 
         assert len(sorted_shop_items) == len(ShopItemObject.every)
         for sio, (shop_index, item_index, item_type_code, day_available) in \
@@ -791,29 +1196,557 @@ class ShopItemObject(TableObject):
             print('WARNING: 0 yen item -', self)
 
 
-if __name__ == '__main__':
-    try:
-        print('TWEWY "Fractalizon" randomizer v%s' % VERSION)
-        print('{0}'.format('-' * 79))
+ALL_OBJECTS = [g for g in globals().values()
+               if isinstance(g, type) and issubclass(g, TableObject)
+               and g not in [TableObject, MappedTableObject]]
 
-        ALL_OBJECTS = [g for g in globals().values()
-                       if isinstance(g, type) and issubclass(g, TableObject)
-                       and g not in [TableObject]]
+CODES = {'easymodo': ['easymodo'],
+         'extra': ['extra'],
+         'phantomthief': ['phantomthief'],
+         'fierce': ['fierce'],
+         'foodie': ['foodie'],
 
-        codes = {'easymodo': ['easymodo'],
-                 'extra': ['extra'],
-                 'phantomthief': ['phantomthief'],
-                 'fierce': ['fierce'],
-                 'foodie': ['foodie'],
+         'vegan': ['vegan'],
+         'lowlevel': ['lowlevel', 'llg'],
+        }
 
-                 'vegan': ['vegan'],
-                 'lowlevel': ['lowlevel', 'llg'],
-                }
 
-        run_interface(ALL_OBJECTS, snes=False, codes=codes,
+def check_codes(codes):
+    # Codes are passed to run_interface() as part of the flags, where an
+    # unknown one would turn on each of its letters as a flag instead.
+    known = {alias for aliases in CODES.values() for alias in aliases}
+    for code in codes:
+        if code not in known:
+            raise ValueError('Unknown code: %s' % code)
+
+
+# Classmethods timed per table by --profile, and the phases they go under.
+PROFILE_PHASES = {'full_randomize': 'randomize',
+                  'randomize_all': 'randomize_all',
+                  'mutate_all': 'mutate_all',
+                  'full_preclean': 'preclean',
+                  'full_cleanup': 'cleanup',
+                  'write_all': 'write',
+                  }
+
+
+def profile_phase(profiler, name):
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+
+def read_batch_file(filename):
+    jobs = []
+    for line in open(filename):
+        line = line.strip()
+        if not (line and line[0] != '#'):
+            continue
+        values = line.split()
+        seed = int(values[0])
+        flags = values[1] if len(values) > 1 else ''
+        random_degree = float(values[2]) if len(values) > 2 else 0.5
+        jobs.append((seed, flags, random_degree))
+    return jobs
+
+
+# False while the output rom is a placeholder from reserve_output() rather
+# than a copy of the source rom.
+OUTPUT_IS_COPY = True
+
+
+def reserve_output(sourcefile, outfile):
+    # Takes the place of the copy of the source rom that run_interface()
+    # makes for the output. The tables are read from the source rom and
+    # written out by write_rom() or write_delta(), so for a known rom the
+    # output only has to exist until then.
+    global OUTPUT_IS_COPY
+    label = (find_cached_label(sourcefile, sorted(read_master()))
+             or get_rom_label(sourcefile) or get_global_label())
+    if label is None:
+        copyfile(sourcefile, outfile)
+        OUTPUT_IS_COPY = True
+        return
+    set_global_label(label)
+    with open(outfile, 'wb') as f:
+        f.truncate(path.getsize(sourcefile))
+    OUTPUT_IS_COPY = False
+
+
+def start_interface():
+    interface = randomtools.interface
+    original_copyfile = interface.copyfile
+    interface.copyfile = reserve_output
+    try:
+        run_interface(ALL_OBJECTS, snes=False, codes=CODES,
                       custom_degree=True)
+    finally:
+        interface.copyfile = original_copyfile
+
+
+def setup_job(sourcefile, seed, flags, random_degree):
+    # run_interface() reads its settings from argv, so fill argv in
+    # rather than prompting for them.
+    argv[1:] = [sourcefile, flags, str(seed), str(random_degree)]
+    start_interface()
+
+
+def load_table_cache():
+    label = get_global_label()
+    if label not in read_master():
+        return False
+
+    data = load_cache(label, get_sourcefile())
+    if data is None:
+        return False
+
+    for o in sort_good_order(ALL_OBJECTS):
+        if '_old_columns' not in o.__dict__:
+            o._old_columns = data['columns'][o.__name__]
+            o._columns_loaded = True
+    nameslibrary.update(data['names'])
+    ShopItemObject._day_shops = data['day_shops']
+    ShopItemObject._schedule = data['schedule']
+    ShopItemObject._requirements = data['requirements']
+    return True
+
+
+def save_table_cache():
+    # Only cache the tables of the rom that master.txt lists for the label.
+    label = get_global_label()
+    if (label not in read_master()
+            or get_file_md5(get_sourcefile()) != read_master()[label][0]):
+        return
+
+    data = {
+        'columns': {o.__name__: o.old_columns
+                    for o in sort_good_order(ALL_OBJECTS)},
+        'names': {nametype: nameslibrary[nametype]
+                  for nametype in NAME_TYPES},
+        'day_shops': ShopItemObject.day_shops,
+        'schedule': ShopItemObject.schedule,
+        'requirements': ShopItemObject.requirements,
+        }
+    save_cache(label, get_sourcefile(), data)
+
+
+# Class attributes that are run settings rather than table state, which
+# restoring a snapshot leaves alone.
+SNAPSHOT_SETTINGS = {'batch_mutate', 'legacy_shop_assign', 'write_tables'}
+
+
+def is_state(key):
+    return not key.startswith('__') and key not in SNAPSHOT_SETTINGS
+
+
+def copy_state(state):
+    return {key: copy(value) if isinstance(value, (list, dict, set))
+            else value for (key, value) in state.items() if is_state(key)}
+
+
+class TableSnapshot(object):
+    # Taken right after the vanilla tables are read, while every field
+    # still holds its value from the vanilla columns. restore() reloads
+    # the fields in bulk from those columns, and puts back a copy of every
+    # other instance and class attribute (cached properties, ranks,
+    # protection marks and randomtools' own bookkeeping), so the tables
+    # end up exactly as they were without re-reading anything.
+    def __init__(self):
+        self.class_states = {o: copy_state(o.__dict__)
+                             for o in ALL_OBJECTS + [MappedTableObject]}
+        self.object_states = {}
+        for o in sort_good_order(ALL_OBJECTS):
+            fields = o.old_columns.fields
+            self.object_states[o] = [
+                (obj, copy_state({key: value
+                                  for (key, value) in obj.__dict__.items()
+                                  if key not in fields}))
+                for obj in o.every]
+
+    def restore(self):
+        for (o, state) in self.class_states.items():
+            for key in list(o.__dict__):
+                if key not in state and is_state(key):
+                    delattr(o, key)
+            for (key, value) in copy_state(state).items():
+                setattr(o, key, value)
+        for (o, object_states) in self.object_states.items():
+            for (obj, state) in object_states:
+                obj.__dict__.clear()
+                obj.__dict__.update(copy_state(state))
+            for name in o.old_columns.fields:
+                values = o.old_columns.values(name)
+                for (obj, _) in object_states:
+                    obj.__dict__[name] = values[obj.index]
+        ShopItemObject._live_indexes = {}
+
+
+VANILLA_SNAPSHOT = None
+
+
+def restore_vanilla_tables():
+    # Call this before setup_job(), not after: run_interface() sets up
+    # class state for the new seed, which restoring would wipe.
+    if VANILLA_SNAPSHOT is not None:
+        VANILLA_SNAPSHOT.restore()
+
+
+def load_vanilla_tables():
+    global VANILLA_SNAPSHOT
+    if VANILLA_SNAPSHOT is not None:
+        return
+
+    cached = load_table_cache()
+    for o in sort_good_order(ALL_OBJECTS):
+        o.every
+    ItemObject.item_indexes
+    QuestObject.quest_indexes
+    if not cached:
+        save_table_cache()
+    VANILLA_SNAPSHOT = TableSnapshot()
+
+
+def get_table_regions():
+    regions = []
+    for o in sort_good_order(ALL_OBJECTS):
+        pointers = [obj.pointer for obj in o.every if obj.total_size]
+        if pointers:
+            regions.append((min(pointers),
+                            max(pointers) + o.every[0].total_size))
+
+    merged = []
+    for (start, end) in sorted(regions):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def encode_table_regions(sourcefile):
+    # The current contents of every table region, as [(start, data), ...],
+    # with any bytes between records kept from the source rom.
+    source = get_rom(sourcefile)
+    regions = [(start, bytearray(source.read(start, end-start)))
+               for (start, end) in get_table_regions()]
+    for o in sort_good_order(ALL_OBJECTS):
+        every = o.every
+        size = every[0].total_size
+        if not size:
+            continue
+        # Tables are stored as contiguous records, so each one is packed in
+        # a single call and spliced in as one block.
+        pointer = every[0].pointer
+        assert all(obj.pointer == pointer + (i * size)
+                   for (i, obj) in enumerate(every))
+        table = o.codec.encode_table(
+            [[getattr(obj, f.name) for f in o.layout] for obj in every])
+        for (start, data) in regions:
+            if start <= pointer < start + len(data):
+                offset = pointer - start
+                data[offset:offset+len(table)] = table
+                break
+    return [(start, bytes(data)) for (start, data) in regions]
+
+
+def write_rom(sourcefile, outfile):
+    # A placeholder output from reserve_output() gets the source rom
+    # streamed into it with the table regions spliced in, so the untouched
+    # bulk of the rom is copied (or reflinked) by the kernel rather than
+    # read and written through this process. An output that is already a
+    # copy of the source rom only needs the table regions written over it.
+    regions = encode_table_regions(sourcefile)
+    close_rom(outfile)
+    if OUTPUT_IS_COPY:
+        write_regions(outfile, regions)
+    else:
+        write_spliced(get_rom(sourcefile), outfile, regions)
+    return outfile
+
+
+def write_delta(sourcefile, outfile):
+    records = []
+    source = get_rom(sourcefile)
+    for (start, data) in encode_table_regions(sourcefile):
+        records.extend(ips32.diff(source.read(start, len(data)), data,
+                                  offset=start))
+    patchfile = '%s.ips32' % path.splitext(outfile)[0]
+    ips32.write_patch_file(records, patchfile)
+    close_rom(outfile)
+    remove(outfile)
+    return patchfile
+
+
+def validate_seed():
+    # Checks the finished tables against requirements.txt, the shop size
+    # limit and item prices, and returns a report that is also a spoiler
+    # log of every shop.
+    earliest_days = ShopItemObject.get_earliest_days()
+    errors = []
+
+    brand_days = defaultdict(dict)
+    for t in ThreadsObject.every:
+        day = earliest_days.get(ItemObject.get_index_by_item(t))
+        if t.equip_type == 3 or day is None:
+            continue
+        equip_days = brand_days[t.brand]
+        if day < equip_days.get(t.equip_type, day+1):
+            equip_days[t.equip_type] = day
+
+    requirements = []
+    for (day, reqs) in ShopItemObject.requirements:
+        for req in reqs:
+            if req.startswith('$'):
+                # Threads of the brand in four different equip types.
+                equip_days = sorted(
+                    brand_days[int(req[1:], 0x10)].values())
+                earliest = equip_days[3] if len(equip_days) >= 4 else None
+            else:
+                earliest = earliest_days.get(int(req, 0x10))
+            ok = earliest is not None and earliest <= day
+            if not ok:
+                errors.append('Requirement %s is not available by day %s.'
+                              % (req, day))
+            requirements.append({'day': day, 'requirement': req,
+                                 'earliest_day': earliest, 'ok': ok})
+
+    # phantomthief makes everything free on purpose.
+    check_prices = 'phantomthief' not in get_activated_codes()
+    shops = defaultdict(list)
+    for sio in ShopItemObject.every:
+        item = sio.item
+        if sio.shop_index is None:
+            errors.append('Item %x is not in any shop.' % sio.item_index)
+            continue
+        if (check_prices and not isinstance(item, QuestObject)
+                and item.price == 0):
+            errors.append('Item %x (%s) costs 0 yen.' % (sio.item_index,
+                                                         item.name))
+        shops['%02x' % sio.shop_index].append({
+            'item_index': sio.item_index, 'name': item.name,
+            'price': item.price, 'day_available': sio.day_available})
+
+    for (shop, items) in sorted(shops.items()):
+        if len(items) > MAX_SHOP_INVENTORY:
+            errors.append('Shop %s has %s items.' % (shop, len(items)))
+
+    for p in PinObject.yen_pins:
+        if p.brand != p.old_data['brand']:
+            errors.append('Yen pin %x has a new brand.' % p.index)
+
+    return {'valid': not errors, 'errors': errors,
+            'requirements': requirements, 'shops': dict(shops)}
+
+
+def write_report(report, filename):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    return filename
+
+
+def run_job(job):
+    sourcefile, seed, flags, random_degree, patch, validate = job
+    start_time = time()
+    try:
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            setup_job(sourcefile, seed, flags, random_degree)
+            clean_and_write(ALL_OBJECTS)
+            close_file(get_outfile())
+            result = get_outfile()
+            report = None
+            if validate:
+                report = validate_seed()
+                write_report(report, '%s.spoiler.json'
+                             % path.splitext(result)[0])
+            if patch:
+                result = write_delta(sourcefile, result)
+            else:
+                write_rom(sourcefile, result)
+        status = 'OK'
+        if report is not None and not report['valid']:
+            status, result = 'INVALID', report['errors'][0]
+    except Exception:
+        status, result = 'FAILED', str(exc_info()[1])
+    return (seed, flags, random_degree, status, result, time() - start_time,
+            ShopItemObject.brand_rerolls)
+
+
+def run_batch(sourcefile, batchfile, num_jobs, summaryfile=None,
+              patch=False, validate=True):
+    # Workers are forked from a parent that has already read the vanilla
+    # tables, and each worker handles a single seed, so every seed starts
+    # from an untouched copy-on-write snapshot of the vanilla objects.
+    if summaryfile is None:
+        summaryfile = '%s.summary.txt' % batchfile
+
+    jobs = [(sourcefile, seed, flags, random_degree, patch, validate)
+            for (seed, flags, random_degree) in read_batch_file(batchfile)]
+    if not jobs:
+        raise Exception('No seeds in %s.' % batchfile)
+
+    with open(devnull, 'w') as null, redirect_stdout(null):
+        setup_job(*jobs[0][:4])
+    load_vanilla_tables()
+    # Each worker writes its output with write_rom() or write_delta().
+    MappedTableObject.write_tables = False
+
+    failures, rerolled = 0, 0
+    with get_context('fork').Pool(num_jobs, maxtasksperchild=1) as pool, \
+            open(summaryfile, 'w') as f:
+        for result in pool.imap_unordered(run_job, jobs):
+            (seed, flags, random_degree, status, message, duration,
+                brand_rerolls) = result
+            if status != 'OK':
+                failures += 1
+            if brand_rerolls:
+                rerolled += 1
+            line = '{0}\t{1}\t{2}\t{3}\t{4}\t{5:.2f}\t{6}'.format(
+                seed, flags, random_degree, status, message, duration,
+                brand_rerolls)
+            print(line)
+            f.write(line + '\n')
+
+    print('{0} seeds, {1} failed, {2} needed brand rerolls. '
+          'Summary: {3}'.format(len(jobs), failures, rerolled, summaryfile))
+
+
+def get_source_rom(rom_bytes, directory=None):
+    # randomtools works on files, so keep one copy of each source rom.
+    if directory is None:
+        directory = gettempdir()
+    filename = path.join(directory,
+                         'fractalizon-%s.nds' % md5(rom_bytes).hexdigest())
+    if not path.exists(filename):
+        temp_filename = '%s.%s' % (filename, getpid())
+        with open(temp_filename, 'wb') as f:
+            f.write(rom_bytes)
+        replace(temp_filename, filename)
+    return filename
+
+
+@contextmanager
+def job_workspace(sourcefile):
+    # Yields a link to the source rom in a directory of its own, since the
+    # output rom is named after the source rom and concurrent jobs would
+    # otherwise collide. argv and stdin, which setup_job() and
+    # run_interface() use, are put back afterwards.
+    workdir = mkdtemp(prefix='fractalizon-')
+    linkfile = path.join(workdir, 'rom.nds')
+    symlink(path.abspath(sourcefile), linkfile)
+
+    saved_argv = list(argv)
+    stdin = sys.stdin
+    sys.stdin = StringIO()
+    try:
+        yield linkfile
+    finally:
+        argv[:] = saved_argv
+        sys.stdin = stdin
+        close_rom(linkfile)
+        rmtree(workdir)
+
+
+def generate_from_file(sourcefile, seed, flags='', codes=None,
+                       random_degree=0.5, output='patch'):
+    # Randomizes one seed without touching argv, stdin or stdout, and
+    # returns the IPS32 patch (or with output='rom', the whole rom) as
+    # bytes. The tables are restored to their vanilla snapshot first, so
+    # it can be called repeatedly in the same process.
+    assert output in ('patch', 'rom')
+    check_codes(codes or [])
+    flags = flags + ''.join(codes or [])
+
+    with job_workspace(sourcefile) as linkfile:
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            restore_vanilla_tables()
+            setup_job(linkfile, seed, flags, random_degree)
+            load_vanilla_tables()
+            MappedTableObject.write_tables = False
+            try:
+                clean_and_write(ALL_OBJECTS)
+            finally:
+                MappedTableObject.write_tables = True
+            outfile = get_outfile()
+            close_file(outfile)
+            if output == 'patch':
+                outfile = write_delta(linkfile, outfile)
+            else:
+                write_rom(linkfile, outfile)
+        with open(outfile, 'rb') as f:
+            return f.read()
+
 
-        clean_and_write(ALL_OBJECTS)
+def generate(rom_bytes, seed, flags='', codes=None, random_degree=0.5,
+             output='patch'):
+    return generate_from_file(get_source_rom(rom_bytes), seed, flags=flags,
+                              codes=codes, random_degree=random_degree,
+                              output=output)
+
+
+if __name__ == '__main__':
+    print('TWEWY "Fractalizon" randomizer v%s' % VERSION)
+    print('{0}'.format('-' * 79))
+
+    if '--legacy-shop-assign' in argv:
+        argv.remove('--legacy-shop-assign')
+        ShopItemObject.legacy_shop_assign = True
+
+    if '--fast-mutate' in argv:
+        argv.remove('--fast-mutate')
+        MappedTableObject.batch_mutate = True
+
+    patch = '--patch' in argv
+    if patch:
+        argv.remove('--patch')
+
+    if '--batch' in argv:
+        parser = ArgumentParser()
+        parser.add_argument('sourcefile')
+        parser.add_argument('--batch', required=True)
+        parser.add_argument('--jobs', type=int, default=cpu_count())
+        parser.add_argument('--summary')
+        parser.add_argument('--no-validate', action='store_true')
+        args = parser.parse_args()
+        run_batch(args.sourcefile, args.batch, args.jobs, args.summary,
+                  patch=patch, validate=not args.no_validate)
+        exit(0)
+
+    profiler, profilefile = None, None
+    for arg in [a for a in argv if a.split('=')[0] == '--profile']:
+        argv.remove(arg)
+        profilefile = arg.partition('=')[2] or None
+        profiler = PhaseProfiler(use_cprofile=(
+            profilefile is not None and not profilefile.endswith('.json')))
+    if profiler is not None:
+        profiler.instrument(ALL_OBJECTS, PROFILE_PHASES)
+
+    try:
+        start_interface()
+        if profiler is not None:
+            profiler.start()
+        with profile_phase(profiler, 'load tables'):
+            load_vanilla_tables()
+
+        # The output is written below in one pass, by write_rom() or
+        # write_delta().
+        MappedTableObject.write_tables = False
+        with profile_phase(profiler, 'clean and write'):
+            clean_and_write(ALL_OBJECTS)
+        close_file(get_outfile())
+        if patch:
+            with profile_phase(profiler, 'write patch'):
+                patchfile = write_delta(get_sourcefile(), get_outfile())
+            print('Patch filename: %s' % patchfile)
+        else:
+            with profile_phase(profiler, 'write rom'):
+                write_rom(get_sourcefile(), get_outfile())
+
+        if profiler is not None:
+            profiler.stop()
+            print(profiler.report())
+            if profilefile is not None:
+                profiler.write(profilefile)
+                print('Profile written to %s' % profilefile)
         finish_interface()
 
     except Exception:
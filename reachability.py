@@ -0,0 +1,70 @@
+class ShopSchedule(object):
+    # Which shops can be visited on each day of the game, built once from
+    # the accessible_*.txt tables. Shop sets are bitsets of shop indexes:
+    # open_bits[day] holds the shops open on that day, and
+    # reachable_bits[day] those open on that day or any day before it.
+    def __init__(self, day_shops):
+        self.last_day = max(day_shops) if day_shops else 0
+        self.open_bits = [0] * (self.last_day + 1)
+        for (day, shops) in day_shops.items():
+            for shop in shops:
+                self.open_bits[day] |= 1 << shop
+
+        self.reachable_bits = list(self.open_bits)
+        for day in range(1, self.last_day + 1):
+            self.reachable_bits[day] |= self.reachable_bits[day-1]
+
+        self.shops_by_day = [tuple(get_shops(bits))
+                             for bits in self.open_bits]
+
+        # next_open_days[shop][day] is the first day on or after the given
+        # day that the shop is open, or None if it never is again.
+        self.next_open_days = {}
+        for shop in get_shops(self.reachable_bits[-1]):
+            next_open_days = [None] * (self.last_day + 2)
+            for day in reversed(range(self.last_day + 1)):
+                if self.is_open(shop, day):
+                    next_open_days[day] = day
+                else:
+                    next_open_days[day] = next_open_days[day+1]
+            self.next_open_days[shop] = next_open_days
+
+    def is_open(self, shop, day):
+        if shop is None or not 0 <= day <= self.last_day:
+            return False
+        return bool(self.open_bits[day] >> shop & 1)
+
+    def shops_on(self, day):
+        if not 0 <= day <= self.last_day:
+            return ()
+        return self.shops_by_day[day]
+
+    def next_open_day(self, shop, day):
+        if shop not in self.next_open_days or day > self.last_day:
+            return None
+        return self.next_open_days[shop][max(day, 0)]
+
+
+def get_shops(bits):
+    shops = []
+    shop = 0
+    while bits:
+        if bits & 1:
+            shops.append(shop)
+        bits >>= 1
+        shop += 1
+    return shops
+
+
+def get_earliest_days(schedule, shop_items):
+    # Maps each item index to the first day it can be bought, given
+    # (shop_index, item_index, day_available) for every shop slot. Items
+    # that are never on sale on an open day are left out.
+    earliest_days = {}
+    for (shop_index, item_index, day_available) in shop_items:
+        day = schedule.next_open_day(shop_index, day_available)
+        if day is None:
+            continue
+        if item_index not in earliest_days or day < earliest_days[item_index]:
+            earliest_days[item_index] = day
+    return earliest_days
@@ -0,0 +1,153 @@
+from mmap import mmap, ACCESS_READ
+import os
+
+
+FILENAME_ADDR = 0x3ac090
+FILEPTR_ADDR = 0x3afe00
+
+
+class RomFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # Slices from read() may outlive the rom, e.g. in the traceback of
+        # an exception on its way out, and the map cannot be closed under
+        # them. Leave it to the garbage collector then, rather than raise
+        # over that exception.
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+    def read(self, start, length):
+        assert start + length <= len(self)
+        return self.view[start:start+length]
+
+    @property
+    def fnt(self):
+        return self.view[FILENAME_ADDR:FILEPTR_ADDR]
+
+    @property
+    def fat(self):
+        return self.view[FILEPTR_ADDR:]
+
+    def read_fnt(self):
+        # Returns the filename table as a list of folder names and lists
+        # of the filenames in each folder, in rom order.
+        fnt = self.fnt
+        filenames = []
+        sub_filenames = []
+        i = 0
+        while True:
+            length = fnt[i]
+            i += 1
+            if length == 0x00:
+                filenames.append(sub_filenames)
+                sub_filenames = []
+                continue
+            if length == 0xFF:
+                break
+            is_folder = bool(length & 0x80)
+            if is_folder:
+                length = (length & 0x7F) + 1
+            filename = bytes(fnt[i:i+length]).decode('latin-1')
+            i += length
+            if is_folder:
+                filenames.append('+' + filename)
+                assert fnt[i] == 0xF0
+                i += 1
+            else:
+                sub_filenames.append(filename)
+        filenames.append(sub_filenames)
+        return filenames
+
+    def read_fat(self):
+        fat = self.fat
+        addresses = []
+        for i in range(0, len(fat) - 7, 8):
+            start_addr = int.from_bytes(fat[i:i+4], byteorder='little')
+            end_addr = int.from_bytes(fat[i+4:i+8], byteorder='little')
+            if 0xFFFFFFFF in [start_addr, end_addr]:
+                break
+            addresses.append((start_addr, end_addr))
+        return addresses
+
+
+def write_fully(f, data):
+    # An unbuffered write may stop short, so keep going until it is all
+    # written.
+    view = memoryview(data)
+    while view:
+        view = view[f.write(view):]
+
+
+def copy_extent(rom, f, start, length):
+    # Let the kernel copy the extent when it can (copy_file_range also
+    # shares the blocks on filesystems with reflinks); f must be unbuffered
+    # so that its position follows the copies made behind its back.
+    src, dst = rom.file.fileno(), f.fileno()
+    end = start + length
+    try:
+        while start < end:
+            if hasattr(os, 'copy_file_range'):
+                copied = os.copy_file_range(src, dst, end-start, start)
+            else:
+                copied = os.sendfile(dst, src, start, end-start)
+            if not copied:
+                break
+            start += copied
+    except (AttributeError, OSError):
+        pass
+    if start < end:
+        write_fully(f, rom.read(start, end-start))
+
+
+def write_spliced(rom, filename, regions):
+    # Writes a copy of the rom with regions, [(address, data), ...], in
+    # place of the original bytes, streaming everything else across.
+    with open(filename, 'wb', buffering=0) as f:
+        position = 0
+        for (address, data) in sorted(regions):
+            assert address >= position
+            copy_extent(rom, f, position, address - position)
+            write_fully(f, data)
+            position = address + len(data)
+        copy_extent(rom, f, position, len(rom) - position)
+
+
+def write_regions(filename, regions):
+    # Writes regions, [(address, data), ...], over an existing copy of the
+    # rom.
+    with open(filename, 'r+b', buffering=0) as f:
+        for (address, data) in sorted(regions):
+            f.seek(address)
+            write_fully(f, data)
+
+
+ROM_FILES = {}
+
+
+def get_rom(filename):
+    if filename not in ROM_FILES:
+        ROM_FILES[filename] = RomFile(filename)
+    return ROM_FILES[filename]
+
+
+def close_rom(filename):
+    if filename in ROM_FILES:
+        ROM_FILES.pop(filename).close()
@@ -0,0 +1,122 @@
+from randomizer import (
+    generate_from_file, setup_job, load_vanilla_tables, check_codes,
+    job_workspace, VERSION)
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import cpu_count, get_context
+from os import path, devnull, remove
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse, parse_qs
+
+
+# Requests look like:
+#   GET /generate?seed=12345&flags=abdft&codes=fierce,vegan&degree=0.5
+# and get back an IPS32 patch, or the whole rom with &output=rom.
+
+SOURCEFILE = None
+POOL = None
+
+
+def generate_job(params):
+    return generate_from_file(SOURCEFILE, **params)
+
+
+def parse_request(query):
+    codes = query.get('codes', [''])[0]
+    return {
+        'seed': int(query['seed'][0]),
+        'flags': query.get('flags', [''])[0],
+        'codes': [c for c in codes.split(',') if c],
+        'random_degree': float(query.get('degree', ['0.5'])[0]),
+        'output': query.get('output', ['patch'])[0],
+        }
+
+
+class GenerateHandler(BaseHTTPRequestHandler):
+    server_version = 'Fractalizon/%s' % VERSION
+
+    def address_string(self):
+        if not self.client_address:
+            return 'unix'
+        return super(GenerateHandler, self).address_string()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/generate':
+            self.send_error(404)
+            return
+
+        try:
+            params = parse_request(parse_qs(url.query))
+            assert params['output'] in ('patch', 'rom')
+        except (KeyError, ValueError, AssertionError):
+            self.send_error(400, 'Expected seed, and optionally flags, '
+                                 'codes, degree and output=patch|rom.')
+            return
+
+        try:
+            check_codes(params['codes'])
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        try:
+            data = POOL.apply(generate_job, (params,))
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def load_tables(sourcefile):
+    # Read the vanilla tables once in this process; the pool workers are
+    # forked from it, one per request, so each starts from vanilla state.
+    with job_workspace(sourcefile) as linkfile:
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            setup_job(linkfile, 0, '', 0)
+        load_vanilla_tables()
+
+
+def serve(sourcefile, port=None, socketfile=None, num_jobs=None):
+    global SOURCEFILE, POOL
+    SOURCEFILE = path.abspath(sourcefile)
+    load_tables(SOURCEFILE)
+
+    if socketfile is not None:
+        if path.exists(socketfile):
+            remove(socketfile)
+        server = UnixHTTPServer(socketfile, GenerateHandler)
+        print('Listening on %s' % socketfile)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', port), GenerateHandler)
+        print('Listening on http://127.0.0.1:%s/' % port)
+
+    with get_context('fork').Pool(num_jobs or cpu_count(),
+                                  maxtasksperchild=1) as POOL:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Serve seeds over local HTTP.')
+    parser.add_argument('sourcefile')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', dest='socketfile',
+                        help='listen on this unix socket instead of a port')
+    parser.add_argument('--jobs', type=int)
+    args = parser.parse_args()
+    serve(args.sourcefile, args.port, args.socketfile, args.jobs)
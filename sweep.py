@@ -0,0 +1,199 @@
+from randomizer import (
+    ALL_OBJECTS, MappedTableObject, EnemyObject, PinObject, QuestObject,
+    ShopItemObject, ThreadsObject, setup_job, load_vanilla_tables,
+    restore_vanilla_tables, job_workspace)
+from randomtools.interface import clean_and_write, get_outfile
+from randomtools.tablereader import close_file
+from argparse import ArgumentParser
+from array import array
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from multiprocessing import cpu_count, get_context
+from os import path, devnull
+from statistics import mean, median
+from sys import exc_info
+from time import time
+import pickle
+
+
+# Randomizes many seeds in memory, without writing any tables, and keeps a
+# few numbers from each so that settings can be compared statistically:
+#   sweep.py <rom> --degrees 0.25,0.5,0.75 --flags b,t,abdft --seeds 1000
+
+NUM_DAYS = 21
+NUM_RANK_BUCKETS = 10
+NUM_BRAVERY_QUANTILES = 5
+DEFAULT_DEGREES = '0.1,0.25,0.5,0.75,1.0'
+DEFAULT_FLAGS = 'a,b,d,f,t,abdft'
+
+# Each vector statistic is stored flattened, this many values per seed.
+VECTOR_COLUMNS = OrderedDict([
+    ('day_prices', NUM_DAYS),
+    ('bravery_quantiles', NUM_BRAVERY_QUANTILES),
+    ('drop_values', NUM_RANK_BUCKETS),
+    ])
+
+SOURCEFILE = None
+
+
+def get_day_prices():
+    # The median price of everything on sale by each day.
+    prices = [[] for _ in range(NUM_DAYS)]
+    for sio in ShopItemObject.every:
+        item = sio.item
+        if isinstance(item, QuestObject) or not hasattr(item, 'price'):
+            continue
+        for day in range(max(sio.day_available, 1), NUM_DAYS + 1):
+            prices[day-1].append(item.price)
+    return [float(median(p)) if p else 0.0 for p in prices]
+
+
+def get_bravery_quantiles():
+    braveries = sorted(t.bravery for t in ThreadsObject.every if t.bravery)
+    if not braveries:
+        return [0.0] * NUM_BRAVERY_QUANTILES
+    last = len(braveries) - 1
+    return [float(braveries[(last * i) // (NUM_BRAVERY_QUANTILES-1)])
+            for i in range(NUM_BRAVERY_QUANTILES)]
+
+
+def get_drop_values():
+    # The mean expected yen value of an enemy's drops, by enemy rank.
+    enemies = sorted([e for e in EnemyObject.every if e.intershuffle_valid],
+                     key=lambda e: (e.rank, e.index))
+    values = [[] for _ in range(NUM_RANK_BUCKETS)]
+    for (i, e) in enumerate(enemies):
+        value = sum(PinObject.get(d % 1000).price * (rate / 10000.0)
+                    for (d, rate) in zip(e.drops, e.drop_rates))
+        values[(i * NUM_RANK_BUCKETS) // len(enemies)].append(value)
+    return [mean(v) if v else 0.0 for v in values]
+
+
+def run_sweep_job(job):
+    seed, flags, random_degree = job
+    start_time = time()
+    stats = None
+    try:
+        with job_workspace(SOURCEFILE) as linkfile, \
+                open(devnull, 'w') as null, redirect_stdout(null):
+            restore_vanilla_tables()
+            setup_job(linkfile, seed, flags, random_degree)
+            try:
+                clean_and_write(ALL_OBJECTS)
+            finally:
+                # Nothing is written to the output rom; the placeholder
+                # reserve_output() made for it goes with the workspace.
+                close_file(get_outfile())
+        stats = {'day_prices': get_day_prices(),
+                 'bravery_quantiles': get_bravery_quantiles(),
+                 'drop_values': get_drop_values()}
+        status, message = 'OK', ''
+    except Exception:
+        status, message = 'FAILED', str(exc_info()[1])
+    return (seed, flags, random_degree, status, message,
+            ShopItemObject.brand_rerolls, time() - start_time, stats)
+
+
+def new_columns():
+    columns = OrderedDict([
+        ('seed', array('q')),
+        ('flags', []),
+        ('random_degree', array('d')),
+        ('status', []),
+        ('message', []),
+        ('brand_rerolls', array('I')),
+        ('duration', array('d')),
+        ])
+    for name in VECTOR_COLUMNS:
+        columns[name] = array('d')
+    return columns
+
+
+def add_row(columns, result):
+    (seed, flags, random_degree, status, message, brand_rerolls, duration,
+        stats) = result
+    columns['seed'].append(seed)
+    columns['flags'].append(flags)
+    columns['random_degree'].append(random_degree)
+    columns['status'].append(status)
+    columns['message'].append(message)
+    columns['brand_rerolls'].append(brand_rerolls)
+    columns['duration'].append(duration)
+    for (name, width) in VECTOR_COLUMNS.items():
+        values = stats[name] if stats is not None else [float('nan')] * width
+        assert len(values) == width
+        columns[name].extend(values)
+
+
+def summarize(columns):
+    cells = OrderedDict()
+    for (i, key) in enumerate(zip(columns['flags'],
+                                  columns['random_degree'])):
+        cells.setdefault(key, []).append(i)
+
+    lines = ['flags\tdegree\tseeds\tfailed\trerolled\tseconds']
+    for ((flags, random_degree), rows) in sorted(cells.items()):
+        failed = sum(1 for i in rows if columns['status'][i] != 'OK')
+        rerolled = sum(1 for i in rows if columns['brand_rerolls'][i])
+        duration = mean(columns['duration'][i] for i in rows)
+        lines.append('{0}\t{1}\t{2}\t{3:.1%}\t{4:.1%}\t{5:.3f}'.format(
+            flags, random_degree, len(rows), failed / float(len(rows)),
+            rerolled / float(len(rows)), duration))
+    return '\n'.join(lines)
+
+
+def sweep(sourcefile, degrees, flag_sets, num_seeds, first_seed=0,
+          num_jobs=None, outfile='sweep.pickle'):
+    global SOURCEFILE
+    SOURCEFILE = path.abspath(sourcefile)
+    jobs = [(seed, flags, random_degree)
+            for flags in flag_sets for random_degree in degrees
+            for seed in range(first_seed, first_seed + num_seeds)]
+
+    columns = new_columns()
+    try:
+        # Load the vanilla tables before forking; each worker then restores
+        # that snapshot between seeds instead of reading the rom again.
+        with job_workspace(SOURCEFILE) as linkfile:
+            with open(devnull, 'w') as null, redirect_stdout(null):
+                setup_job(linkfile, first_seed, flag_sets[0], degrees[0])
+            load_vanilla_tables()
+        MappedTableObject.write_tables = False
+
+        with get_context('fork').Pool(num_jobs or cpu_count()) as pool:
+            for result in pool.imap_unordered(run_sweep_job, jobs,
+                                              chunksize=16):
+                add_row(columns, result)
+            pool.close()
+            pool.join()
+    finally:
+        MappedTableObject.write_tables = True
+
+    with open(outfile, 'wb') as f:
+        pickle.dump({'vector_columns': dict(VECTOR_COLUMNS),
+                     'columns': columns}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return columns
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Sweep seeds over randomness levels and flags.')
+    parser.add_argument('sourcefile')
+    parser.add_argument('--degrees', default=DEFAULT_DEGREES,
+                        help='comma separated randomness levels')
+    parser.add_argument('--flags', default=DEFAULT_FLAGS,
+                        help='comma separated flag combinations')
+    parser.add_argument('--seeds', type=int, default=100,
+                        help='seeds per combination')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int)
+    parser.add_argument('--output', default='sweep.pickle')
+    args = parser.parse_args()
+
+    columns = sweep(args.sourcefile,
+                    [float(d) for d in args.degrees.split(',')],
+                    args.flags.split(','), args.seeds, args.first_seed,
+                    args.jobs, args.output)
+    print(summarize(columns))
+    print('Results written to %s' % args.output)
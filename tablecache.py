@@ -0,0 +1,74 @@
+from randomtools.tablereader import tblpath
+from os import path, listdir, makedirs, environ, replace, remove, getpid
+import pickle
+
+
+CACHE_VERSION = 3
+CACHE_DIRECTORY = path.join(
+    environ.get('XDG_CACHE_HOME', path.join(path.expanduser('~'), '.cache')),
+    'fractalizon')
+
+
+def get_rom_identity(filename):
+    return (path.realpath(filename), path.getsize(filename),
+            path.getmtime(filename))
+
+
+def get_cache_key(label, sourcefile):
+    # Keyed on the source rom's path, size and mtime rather than its hash,
+    # so a warm start never reads the whole rom; save_cache() callers check
+    # the hash once instead. Any edit to a table file also misses.
+    mtimes = tuple(sorted(
+        (filename, path.getmtime(path.join(tblpath, filename)))
+        for filename in listdir(tblpath) if filename.endswith('.txt')))
+    return (CACHE_VERSION, label, get_rom_identity(sourcefile), mtimes)
+
+
+def get_cache_filename(label):
+    return path.join(CACHE_DIRECTORY, '%s.pickle' % label)
+
+
+def load_cache(label, sourcefile, key_only=False):
+    # The key and the data are pickled one after the other, so the key can
+    # be checked without loading the data.
+    filename = get_cache_filename(label)
+    if not path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            if pickle.load(f) != get_cache_key(label, sourcefile):
+                return None
+            if key_only:
+                return True
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def find_cached_label(sourcefile, labels):
+    # The label of a rom that the table cache has already seen, if any.
+    for label in labels:
+        if load_cache(label, sourcefile, key_only=True):
+            return label
+    return None
+
+
+def save_cache(label, sourcefile, data):
+    # The cache is only an optimization, so any failure to write it (a
+    # read-only cache directory, a full disk) just skips caching.
+    filename = get_cache_filename(label)
+    # Write to a temporary file first so that concurrent processes never
+    # see a partial cache.
+    temp_filename = '%s.%s' % (filename, getpid())
+    try:
+        makedirs(CACHE_DIRECTORY, exist_ok=True)
+        with open(temp_filename, 'wb') as f:
+            pickle.dump(get_cache_key(label, sourcefile), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temp_filename, filename)
+    except OSError:
+        pass
+    finally:
+        if path.exists(temp_filename):
+            remove(temp_filename)
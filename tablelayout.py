@@ -0,0 +1,169 @@
+from randomtools.tablereader import tblpath
+from collections import namedtuple
+from hashlib import md5
+from os import path
+from struct import Struct
+
+
+MASTER_FILENAME = 'master.txt'
+
+Field = namedtuple('Field', ['name', 'number', 'size', 'is_list'])
+TableSpec = namedtuple('TableSpec', ['tablefile', 'pointer', 'count'])
+
+
+def read_layout(filename):
+    # Each line is "name,size" or "name,size,list", where a list size is
+    # either a byte count or "<number>x<size>".
+    layout = []
+    for line in open(path.join(tblpath, filename)):
+        line = line.strip()
+        if not (line and line[0] != '#'):
+            continue
+        values = line.split(',')
+        name, size = values[0], values[1]
+        is_list = len(values) > 2 and values[2] == 'list'
+        if 'x' in size:
+            number, size = size.split('x')
+            number, size = int(number), int(size)
+        elif is_list:
+            number, size = int(size), 1
+        else:
+            number, size = 1, int(size)
+        layout.append(Field(name, number, size, is_list))
+    return layout
+
+
+def get_record_size(layout):
+    return sum(f.number * f.size for f in layout)
+
+
+STRUCT_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+class RecordCodec(object):
+    # A layout compiled into a struct format, so that a record, or a whole
+    # table of them, is packed or unpacked in a single call. Unpacked
+    # records are flat tuples with every list field spread out in place.
+    def __init__(self, layout):
+        self.layout = layout
+        self.format = ''.join('%s%s' % (f.number, STRUCT_CODES[f.size])
+                              for f in layout)
+        self.struct = Struct('<' + self.format)
+        self.size = self.struct.size
+        assert self.size == get_record_size(layout)
+        self.table_structs = {}
+
+    def flatten(self, values):
+        # values is a list of field values, in layout order.
+        flat = []
+        for (f, value) in zip(self.layout, values):
+            if f.is_list:
+                assert len(value) == f.number
+                flat.extend(value)
+            else:
+                flat.append(value)
+        return flat
+
+    def encode(self, values):
+        return self.struct.pack(*self.flatten(values))
+
+    def decode_table(self, data, count):
+        if not self.size:
+            return [()] * count
+        return list(self.struct.iter_unpack(data[:self.size * count]))
+
+    def encode_table(self, records):
+        # records holds a list of field values for each record.
+        count = len(records)
+        if count not in self.table_structs:
+            self.table_structs[count] = Struct('<' + self.format * count)
+        flat = []
+        for values in records:
+            flat.extend(self.flatten(values))
+        return self.table_structs[count].pack(*flat)
+
+
+CODECS = {}
+
+
+def get_codec(layout):
+    key = tuple(layout)
+    if key not in CODECS:
+        CODECS[key] = RecordCodec(layout)
+    return CODECS[key]
+
+
+def encode_record(layout, values):
+    # values maps each field name to an int, or a list of ints for list
+    # fields.
+    return get_codec(layout).encode([values[f.name] for f in layout])
+
+
+def read_tables_list(filename):
+    tables = {}
+    for line in open(path.join(tblpath, filename)):
+        line = line.strip()
+        if not (line and line[0] != '#'):
+            continue
+        objname, tablefile, pointer, count = line.split()[:4]
+        tables[objname] = TableSpec(tablefile, int(pointer, 0x10),
+                                    int(count))
+    return tables
+
+
+def read_master():
+    master = {}
+    for line in open(path.join(tblpath, MASTER_FILENAME)):
+        line = line.strip()
+        if not line:
+            continue
+        label, md5, filename = line.split()
+        master[label] = (md5, filename)
+    return master
+
+
+def get_tables_list_filename(label):
+    return read_master()[label][1]
+
+
+FILE_MD5S = {}
+
+
+def get_file_md5(filename):
+    # Roms are large, so each version of a file is only hashed once.
+    key = (path.realpath(filename), path.getsize(filename),
+           path.getmtime(filename))
+    if key not in FILE_MD5S:
+        digest = md5()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        FILE_MD5S[key] = digest.hexdigest()
+    return FILE_MD5S[key]
+
+
+def get_rom_label(filename):
+    # The master.txt label for the rom, or None if it is not a known rom.
+    rom_md5 = get_file_md5(filename)
+    for (label, (master_md5, _)) in sorted(read_master().items()):
+        if master_md5 == rom_md5:
+            return label
+    return None
+
+
+LAYOUTS = {}
+
+
+def get_layout(tablefile):
+    if tablefile not in LAYOUTS:
+        LAYOUTS[tablefile] = read_layout(tablefile)
+    return LAYOUTS[tablefile]
+
+
+TABLE_SPECS = {}
+
+
+def get_table_specs(label):
+    if label not in TABLE_SPECS:
+        TABLE_SPECS[label] = read_tables_list(get_tables_list_filename(label))
+    return TABLE_SPECS[label]
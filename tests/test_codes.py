@@ -0,0 +1,24 @@
+from os import path
+from sys import path as sys_path
+import pytest
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+pytest.importorskip('randomtools')
+
+from randomizer import CODES, check_codes, generate_from_file
+
+
+def test_known_codes():
+    check_codes([alias for aliases in CODES.values() for alias in aliases])
+
+
+def test_unknown_code():
+    with pytest.raises(ValueError, match='vegn'):
+        check_codes(['vegan', 'vegn'])
+
+
+def test_generate_rejects_unknown_code():
+    # The codes are checked before the rom is even opened.
+    with pytest.raises(ValueError, match='Unknown code: vegn'):
+        generate_from_file('missing.nds', 12345, codes=['vegn'])